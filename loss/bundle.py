@@ -0,0 +1,154 @@
+import torch
+import torch.nn.functional as F
+
+from loss.pose3d import bone_len_loss, loss_online_mutual
+
+# H36M skeleton, the same limbs and limb pairs used by loss_limb_var, loss_limb_gt and loss_angle
+LIMBS_ID = [[0, 1], [1, 2], [2, 3], [0, 4], [4, 5], [5, 6], [0, 7], [7, 8], [8, 9], [9, 10],
+            [8, 11], [11, 12], [12, 13], [8, 14], [14, 15], [15, 16]]
+ANGLES_ID = [[0, 3], [0, 6], [3, 6], [0, 1], [1, 2], [3, 4], [4, 5], [6, 7], [7, 10], [7, 13],
+             [8, 13], [10, 13], [7, 8], [8, 9], [10, 11], [11, 12], [13, 14], [14, 15]]
+ANGLE_EPS = 1e-7
+
+
+def _head_mean(x):
+    """Mean over everything but the leading head dimension."""
+    return x.flatten(1).mean(dim=1)
+
+
+class PoseLossBundle(object):
+    """
+    Evaluates the weighted sum of the 3D pose losses of loss.pose3d in one pass.
+    Bones, limb lengths, frame differences and limb angles are built once per prediction and shared by
+    all terms, terms with a zero weight are not computed at all, and the predictions of all output heads
+    are stacked so every term is evaluated for every head at once. The exception is bone_length, which calls
+    loss.pose3d.bone_len_loss once per head.
+
+    weights: dict mapping term names to weights. Supported terms are
+             '3d_pose', '3d_scale', '3d_velocity', 'lv', 'lg', 'angle', 'angle_velocity' and 'bone_length'
+    head_weights: weight of every output head in the total loss
+    head_suffixes: suffix appended to the component names of every head
+    online_mutual_weight: weight of loss_online_mutual between the first two heads
+    """
+    TERMS = ['3d_pose', '3d_scale', '3d_velocity', 'lv', 'lg', 'angle', 'angle_velocity', 'bone_length']
+
+    def __init__(self, weights, head_weights=(1.0,), head_suffixes=('',), online_mutual_weight=0.0):
+        unknown = set(weights) - set(self.TERMS)
+        assert not unknown, f"Unknown loss terms {sorted(unknown)}"
+        assert len(head_weights) == len(head_suffixes)
+        self.term_names = list(weights)
+        self.weights = {name: weight for name, weight in weights.items() if weight != 0}
+        self.head_weights = head_weights
+        self.head_suffixes = head_suffixes
+        self.online_mutual_weight = online_mutual_weight
+
+    @classmethod
+    def from_args(cls, args, bone_length=False, mutual=False):
+        """
+        Builds the loss used by the trainers from the config lambdas.
+        bone_length: include bone_len_loss weighted by args.lambda_bone_length
+        mutual: the model returns (pred, pred_mo); weight the heads by args.lambda_org / args.lambda_mo
+                and add loss_online_mutual weighted by args.lambda_olm
+        """
+        weights = {
+            '3d_pose': 1.0,
+            '3d_scale': args.lambda_scale,
+            '3d_velocity': args.lambda_3d_velocity,
+            'lv': args.lambda_lv,
+            'lg': args.lambda_lg,
+            'angle': args.lambda_a,
+            'angle_velocity': args.lambda_av,
+        }
+        if bone_length:
+            weights['bone_length'] = args.lambda_bone_length
+        if mutual:
+            return cls(weights, head_weights=(args.lambda_org, args.lambda_mo), head_suffixes=('', '_mo'),
+                       online_mutual_weight=args.lambda_olm)
+        return cls(weights)
+
+    def component_names(self):
+        """Names of all components __call__ can return, including the ones skipped for a zero weight"""
+        names = [name + suffix for suffix in self.head_suffixes for name in self.term_names]
+        if len(self.head_suffixes) > 1:
+            names.append('online_mutual')
+        return names
+
+    def terms(self, pred, y):
+        """
+        pred: stacked predictions of all heads (H, N, T, J, 3)
+        y: ground truth (N, T, J, 3)
+        Returns a dict mapping every non-zero term to its per-head values (H,)
+        """
+        w = self.weights
+        n_frames = pred.shape[2]
+        terms = {}
+
+        if '3d_pose' in w:
+            terms['3d_pose'] = _head_mean(torch.norm(pred - y, dim=-1))
+        if '3d_scale' in w:
+            norm_predicted = torch.mean(torch.sum(pred ** 2, dim=-1, keepdim=True), dim=-2, keepdim=True)
+            norm_target = torch.mean(torch.sum(y * pred, dim=-1, keepdim=True), dim=-2, keepdim=True)
+            scale = norm_target / norm_predicted
+            terms['3d_scale'] = _head_mean(torch.norm(scale * pred - y, dim=-1))
+        if '3d_velocity' in w:
+            if n_frames <= 1:
+                terms['3d_velocity'] = pred.new_zeros(pred.shape[0])
+            else:
+                velocity_predicted = pred[:, :, 1:] - pred[:, :, :-1]
+                velocity_target = y[:, 1:] - y[:, :-1]
+                terms['3d_velocity'] = _head_mean(torch.norm(velocity_predicted - velocity_target, dim=-1))
+
+        if any(name in w for name in ('lv', 'lg', 'angle', 'angle_velocity')):
+            limbs = torch.tensor(LIMBS_ID, device=pred.device)
+            bones_pred = pred[..., limbs[:, 0], :] - pred[..., limbs[:, 1], :]
+            bones_gt = y[..., limbs[:, 0], :] - y[..., limbs[:, 1], :]
+
+            if 'lv' in w or 'lg' in w:
+                limb_lens_pred = torch.norm(bones_pred, dim=-1)
+                if 'lv' in w:
+                    if n_frames <= 1:
+                        terms['lv'] = pred.new_zeros(pred.shape[0])
+                    else:
+                        terms['lv'] = _head_mean(torch.var(limb_lens_pred, dim=2))
+                if 'lg' in w:
+                    terms['lg'] = _head_mean(torch.abs(limb_lens_pred - torch.norm(bones_gt, dim=-1)))
+
+            if 'angle' in w or 'angle_velocity' in w:
+                pairs = torch.tensor(ANGLES_ID, device=pred.device)
+                angles_pred = torch.acos(F.cosine_similarity(bones_pred[..., pairs[:, 0], :], bones_pred[..., pairs[:, 1], :],
+                                                             dim=-1).clamp(-1 + ANGLE_EPS, 1 - ANGLE_EPS))
+                angles_gt = torch.acos(F.cosine_similarity(bones_gt[..., pairs[:, 0], :], bones_gt[..., pairs[:, 1], :],
+                                                           dim=-1).clamp(-1 + ANGLE_EPS, 1 - ANGLE_EPS))
+                if 'angle' in w:
+                    terms['angle'] = _head_mean(torch.abs(angles_pred - angles_gt))
+                if 'angle_velocity' in w:
+                    angle_velocity_pred = angles_pred[:, :, 1:] - angles_pred[:, :, :-1]
+                    angle_velocity_gt = angles_gt[:, 1:] - angles_gt[:, :-1]
+                    terms['angle_velocity'] = _head_mean(torch.abs(angle_velocity_pred - angle_velocity_gt))
+
+        if 'bone_length' in w:
+            terms['bone_length'] = torch.stack([bone_len_loss(head, y) for head in pred])
+        return terms
+
+    def __call__(self, preds, y):
+        """
+        preds: prediction (N, T, J, 3), or a tuple with the prediction of every head
+        y: ground truth (N, T, J, 3)
+        Returns the weighted total loss and a dict with every computed component
+        """
+        heads = preds if isinstance(preds, (tuple, list)) else (preds,)
+        heads = [head.float() for head in heads]  # Losses are always computed in fp32
+        assert len(heads) == len(self.head_weights)
+        terms = self.terms(torch.stack(heads), y)
+
+        head_weights = heads[0].new_tensor(self.head_weights)
+        total = 0
+        components = {}
+        for name, values in terms.items():
+            total = total + self.weights[name] * torch.sum(head_weights * values)
+            for suffix, value in zip(self.head_suffixes, values):
+                components[name + suffix] = value
+        if self.online_mutual_weight != 0:
+            components['online_mutual'] = loss_online_mutual(heads[0], heads[1], y)
+            total = total + self.online_mutual_weight * components['online_mutual']
+        return total, components
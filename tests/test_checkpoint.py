@@ -0,0 +1,62 @@
+import os
+
+from utils.checkpoint import CheckpointManager
+
+
+def text_writer(path, state):
+    with open(path, 'w') as file:
+        file.write(str(state))
+
+
+def save_epochs(manager, directory, scores, k, first_epoch=0):
+    for epoch, score in enumerate(scores, start=first_epoch):
+        path = os.path.join(directory, f'epoch_{epoch}.txt')
+        manager.save_top_k('', k, path, {'epoch': epoch}, score, writer=text_writer)
+    manager.wait()
+
+
+def snapshots(directory):
+    return sorted(name for name in os.listdir(directory) if not name.startswith('.'))
+
+
+def test_save_top_k_keeps_the_k_lowest_scores(tmp_path):
+    manager = CheckpointManager()
+    save_epochs(manager, tmp_path, [5.0, 3.0, 4.0, 6.0, 1.0, 2.0], k=3)
+    assert snapshots(tmp_path) == ['epoch_1.txt', 'epoch_4.txt', 'epoch_5.txt']
+    assert [score for score, _ in manager.top_k['']] == [1.0, 2.0, 3.0]
+
+
+def test_save_top_k_skips_worse_checkpoints(tmp_path):
+    manager = CheckpointManager()
+    save_epochs(manager, tmp_path, [1.0, 2.0], k=2)
+    assert not manager.save_top_k('', 2, os.path.join(tmp_path, 'worse.txt'), {}, 3.0, writer=text_writer)
+    manager.wait()
+    assert snapshots(tmp_path) == ['epoch_0.txt', 'epoch_1.txt']
+
+
+def test_top_k_survives_resume(tmp_path):
+    manager = CheckpointManager()
+    save_epochs(manager, tmp_path, [5.0, 3.0, 4.0], k=3)
+    state = manager.top_k_state()
+
+    resumed = CheckpointManager()
+    resumed.restore_top_k(state, tmp_path, k=3)
+    save_epochs(resumed, tmp_path, [2.0, 6.0, 1.0], k=3, first_epoch=3)
+    assert snapshots(tmp_path) == ['epoch_1.txt', 'epoch_3.txt', 'epoch_5.txt']
+
+
+def test_restore_top_k_evicts_beyond_k_and_ignores_other_directories(tmp_path):
+    manager = CheckpointManager()
+    save_epochs(manager, tmp_path, [5.0, 3.0, 4.0], k=3)
+    other = tmp_path / 'other'
+    other.mkdir()
+    text_writer(other / 'epoch_9.txt', {})
+    state = manager.top_k_state()
+    state[''].append((0.5, str(other / 'epoch_9.txt')))
+
+    resumed = CheckpointManager()
+    resumed.restore_top_k(state, tmp_path, k=2)
+    resumed.wait()
+    assert snapshots(tmp_path) == ['epoch_1.txt', 'epoch_2.txt', 'other']
+    assert os.path.exists(other / 'epoch_9.txt')
+    assert [score for score, _ in resumed.top_k['']] == [3.0, 4.0]
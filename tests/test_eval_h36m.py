@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from loss.pose3d import p_mpjpe
+from utils.eval_h36m import EvalIndex, batch_p_mpjpe, evaluate_h36m
+
+N_JOINTS = 17
+CLIP_LEN = 12
+
+
+def synthetic_split(rng, num_frames=90, n_actions=3):
+    """
+    Test frames split into clips the way split_clips does it: overlapping windows over every sequence,
+    plus resampled clips of a sequence shorter than CLIP_LEN that repeat frames at consecutive positions.
+    """
+    frame_clips = [np.arange(start, start + CLIP_LEN) for start in range(0, 60 - CLIP_LEN + 1, 5)]
+    frame_clips.append(np.arange(60 - CLIP_LEN, 60))
+    short = np.arange(60, 60 + CLIP_LEN // 2)
+    frame_clips.append(np.repeat(short, 2))
+    frame_clips.append(np.sort(rng.choice(short, CLIP_LEN)))
+    frame_clips += [np.arange(start, start + CLIP_LEN) for start in range(66, num_frames - CLIP_LEN + 1, 4)]
+    frame_clips = np.stack(frame_clips)
+
+    valid_clips = rng.random(len(frame_clips)) > 0.2
+    valid_clips[0] = True
+    action_ids = np.sort(rng.integers(0, n_actions, num_frames))
+    action_ids[:n_actions] = np.arange(n_actions)  # Every action has frames
+    action_names = np.array([f'action_{i}' for i in range(n_actions)])
+    factors = rng.uniform(0.5, 2, num_frames)
+    gts = rng.normal(scale=300, size=(num_frames, N_JOINTS, 3))
+    return frame_clips, valid_clips, factors, gts, action_ids, action_names
+
+
+def reference_evaluation(results_all, frame_clips, valid_clips, factors, gts, action_ids, n_actions):
+    """The per-clip loop evaluate_h36m replaced."""
+    num_frames = len(action_ids)
+    e1_all = np.zeros(num_frames)
+    e2_all = np.zeros(num_frames)
+    acc_err_all = np.zeros(num_frames)
+    jpe_all = np.zeros((num_frames, N_JOINTS))
+    oc = np.zeros(num_frames)
+    for idx in range(len(frame_clips)):
+        if not valid_clips[idx]:
+            continue
+        frame_list = frame_clips[idx]
+        pred = results_all[idx] * factors[frame_list][:, None, None]
+        gt = gts[frame_list]
+        pred = pred - pred[:, 0:1, :]
+        gt = gt - gt[:, 0:1, :]
+        jpe = np.linalg.norm(pred - gt, axis=-1)
+        accel_gt = gt[:-2] - 2 * gt[1:-1] + gt[2:]
+        accel_pred = pred[:-2] - 2 * pred[1:-1] + pred[2:]
+        e1_all[frame_list] += np.mean(jpe, axis=-1)
+        e2_all[frame_list] += p_mpjpe(pred, gt)
+        jpe_all[frame_list] += jpe
+        acc_err_all[frame_list[:-2]] += np.mean(np.linalg.norm(accel_pred - accel_gt, axis=-1), axis=-1)
+        oc[frame_list] += 1
+
+    results = {name: [[] for _ in range(n_actions)] for name in ('mpjpe', 'p_mpjpe', 'acceleration', 'joints')}
+    for idx in range(num_frames):
+        if e1_all[idx] > 0:
+            action = action_ids[idx]
+            results['mpjpe'][action].append(e1_all[idx] / oc[idx])
+            results['p_mpjpe'][action].append(e2_all[idx] / oc[idx])
+            results['acceleration'][action].append(acc_err_all[idx] / oc[idx])
+            results['joints'][action].append(jpe_all[idx] / oc[idx])
+    return {name: np.array([np.mean(values, axis=0) for values in per_action])
+            for name, per_action in results.items()}
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_evaluate_h36m_matches_per_clip_loop(seed):
+    rng = np.random.default_rng(seed)
+    frame_clips, valid_clips, factors, gts, action_ids, action_names = synthetic_split(rng)
+    results_all = rng.normal(scale=300, size=(len(frame_clips), CLIP_LEN, N_JOINTS, 3))
+
+    gt = gts[frame_clips[valid_clips]]
+    gt = gt - gt[:, :, 0:1, :]
+    index = EvalIndex(valid_clips, frame_clips[valid_clips], factors[frame_clips[valid_clips]], gt,
+                      action_ids, action_names)
+    metrics = evaluate_h36m(results_all, index=index)
+    expected = reference_evaluation(results_all, frame_clips, valid_clips, factors, gts, action_ids,
+                                    len(action_names))
+
+    np.testing.assert_allclose(metrics['action_mpjpe'], expected['mpjpe'])
+    np.testing.assert_allclose(metrics['action_p_mpjpe'], expected['p_mpjpe'])
+    np.testing.assert_allclose(metrics['action_acceleration'], expected['acceleration'])
+    np.testing.assert_allclose(metrics['joint_errors'], np.mean(expected['joints'], axis=0))
+    np.testing.assert_allclose(metrics['mpjpe'], np.mean(expected['mpjpe']))
+    np.testing.assert_allclose(metrics['p_mpjpe'], np.mean(expected['p_mpjpe']))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_batch_p_mpjpe_matches_p_mpjpe(seed):
+    rng = np.random.default_rng(seed)
+    target = rng.normal(size=(32, N_JOINTS, 3))
+    rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+    predicted = 1.5 * target @ rotation + rng.normal(scale=0.1, size=target.shape) + rng.normal(size=3)
+    predicted[:8, :, 0] *= -1  # Mirrored poses need the reflection correction
+
+    np.testing.assert_allclose(batch_p_mpjpe(predicted, target), p_mpjpe(predicted, target), rtol=1e-6)
+    clips = batch_p_mpjpe(predicted.reshape(4, 8, N_JOINTS, 3), target.reshape(4, 8, N_JOINTS, 3))
+    np.testing.assert_allclose(clips.reshape(-1), p_mpjpe(predicted, target), rtol=1e-6)
@@ -0,0 +1,49 @@
+import copy
+
+import pytest
+import torch
+from torch import nn
+
+from utils.grad_checkpoint import CheckpointedBlock, apply_grad_checkpoint
+
+
+class ToyStack(nn.Module):
+    def __init__(self, dim=8, depth=4):
+        super().__init__()
+        self.embed = nn.Linear(3, dim)
+        self.layers = nn.ModuleList([nn.Sequential(nn.Linear(dim, dim), nn.GELU(), nn.LayerNorm(dim))
+                                     for _ in range(depth)])
+        self.head = nn.Linear(dim, 3)
+
+    def forward(self, x):
+        x = self.embed(x)
+        for layer in self.layers:
+            x = x + layer(x)
+        return self.head(x)
+
+
+@pytest.mark.parametrize('mode', ['every_n', 'all'])
+def test_checkpointed_model_matches_eager(mode):
+    torch.manual_seed(0)
+    model = ToyStack()
+    checkpointed = copy.deepcopy(model)
+    n_blocks = apply_grad_checkpoint(checkpointed, mode, every_n=2)
+    assert n_blocks == (4 if mode == 'all' else 2)
+    assert sum(isinstance(layer, CheckpointedBlock) for layer in checkpointed.layers) == n_blocks
+
+    assert list(checkpointed.state_dict()) == list(model.state_dict())
+    checkpointed.load_state_dict(model.state_dict())
+    model.load_state_dict(checkpointed.state_dict())
+
+    x = torch.randn(2, 5, 3)
+    model(x).square().mean().backward()
+    checkpointed(x).square().mean().backward()
+    for param, param_checkpointed in zip(model.parameters(), checkpointed.parameters()):
+        torch.testing.assert_close(param.grad, param_checkpointed.grad)
+
+
+def test_checkpointed_block_forwards_attributes():
+    block = nn.Linear(4, 4)
+    wrapped = CheckpointedBlock(block)
+    assert wrapped.in_features == 4
+    assert wrapped.weight is block.weight
@@ -0,0 +1,60 @@
+import pytest
+import torch
+from torch import nn
+
+from utils.data import flip_data
+from utils.inference import flip_inference
+
+N_JOINTS = 17
+LEFT_3DHP = [5, 6, 7, 11, 12, 13]
+RIGHT_3DHP = [2, 3, 4, 8, 9, 10]
+
+
+class ToyLifter(nn.Module):
+    """Mixes joints and channels, so mirroring the input does not simply mirror the output."""
+    def __init__(self, dim_in=3, n_heads=1):
+        super().__init__()
+        self.joint_mixing = nn.Parameter(torch.randn(N_JOINTS, N_JOINTS) / N_JOINTS)
+        self.heads = nn.ModuleList([nn.Linear(dim_in, 3) for _ in range(n_heads)])
+
+    def forward(self, x):
+        x = torch.einsum('ij,ntjc->ntic', self.joint_mixing, x)
+        outputs = tuple(head(x) for head in self.heads)
+        return outputs if len(outputs) > 1 else outputs[0]
+
+
+def two_pass_reference(model, x, **flip_kwargs):
+    outputs = model(x)
+    outputs_flip = model(flip_data(x, **flip_kwargs))
+    if not isinstance(outputs, tuple):
+        return (outputs + flip_data(outputs_flip, **flip_kwargs)) / 2
+    return tuple((output + flip_data(output_flip, **flip_kwargs)) / 2
+                 for output, output_flip in zip(outputs, outputs_flip))
+
+
+@pytest.mark.parametrize('n_heads', [1, 3])
+def test_flip_inference_matches_two_passes(n_heads):
+    torch.manual_seed(n_heads)
+    model = ToyLifter(n_heads=n_heads).eval()
+    x = torch.randn(4, 9, N_JOINTS, 3)
+    with torch.no_grad():
+        output = flip_inference(model, x)
+        expected = two_pass_reference(model, x)
+
+    if n_heads == 1:
+        assert isinstance(output, torch.Tensor)
+        output, expected = (output,), (expected,)
+    assert isinstance(output, tuple) and len(output) == n_heads
+    for head_output, head_expected in zip(output, expected):
+        torch.testing.assert_close(head_output, head_expected)
+
+
+def test_flip_inference_with_given_mirror_and_joints():
+    torch.manual_seed(0)
+    model = ToyLifter(dim_in=2).eval()
+    x = torch.randn(2, 5, N_JOINTS, 2)
+    flip_kwargs = {'left_joints': LEFT_3DHP, 'right_joints': RIGHT_3DHP}
+    with torch.no_grad():
+        output = flip_inference(model, x, flip_data(x, **flip_kwargs), LEFT_3DHP, RIGHT_3DHP)
+        expected = two_pass_reference(model, x, **flip_kwargs)
+    torch.testing.assert_close(output, expected)
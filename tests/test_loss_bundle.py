@@ -0,0 +1,83 @@
+from functools import partial
+from types import SimpleNamespace
+
+import pytest
+import torch
+
+from loss.bundle import PoseLossBundle
+from loss.pose3d import loss_mpjpe, n_mpjpe, loss_velocity, loss_limb_var, loss_limb_gt, loss_angle, \
+    loss_angle_velocity, bone_len_loss, loss_online_mutual
+
+ARGS = SimpleNamespace(lambda_scale=0.5, lambda_3d_velocity=20.0, lambda_lv=0.3, lambda_lg=0.4, lambda_a=0.6,
+                       lambda_av=0.7, lambda_bone_length=0.8, lambda_org=1.0, lambda_mo=0.9, lambda_olm=0.2)
+
+REFERENCE_TERMS = {
+    '3d_pose': loss_mpjpe,
+    '3d_scale': n_mpjpe,
+    '3d_velocity': loss_velocity,
+    'lv': lambda pred, y: loss_limb_var(pred),
+    'lg': loss_limb_gt,
+    'angle': loss_angle,
+    'angle_velocity': loss_angle_velocity,
+    'bone_length': bone_len_loss,
+}
+# The bundle sums in a different order than the per-term functions
+assert_close = partial(torch.testing.assert_close, rtol=1e-4, atol=1e-5)
+
+TERM_LAMBDAS = {
+    '3d_pose': 1.0,
+    '3d_scale': ARGS.lambda_scale,
+    '3d_velocity': ARGS.lambda_3d_velocity,
+    'lv': ARGS.lambda_lv,
+    'lg': ARGS.lambda_lg,
+    'angle': ARGS.lambda_a,
+    'angle_velocity': ARGS.lambda_av,
+    'bone_length': ARGS.lambda_bone_length,
+}
+
+
+def random_poses(seed, n=3, t=9):
+    generator = torch.Generator().manual_seed(seed)
+    return torch.randn(n, t, 17, 3, generator=generator)
+
+
+def head_total(pred, y, names):
+    return sum(TERM_LAMBDAS[name] * REFERENCE_TERMS[name](pred, y) for name in names)
+
+
+@pytest.mark.parametrize('bone_length', [False, True])
+def test_single_head_matches_pose3d(bone_length):
+    pred, y = random_poses(0), random_poses(1)
+    loss_fn = PoseLossBundle.from_args(ARGS, bone_length=bone_length)
+    total, components = loss_fn(pred, y)
+
+    names = [name for name in TERM_LAMBDAS if bone_length or name != 'bone_length']
+    assert set(components) == set(names)
+    for name in names:
+        assert_close(components[name], REFERENCE_TERMS[name](pred, y), msg=name)
+    assert_close(total, head_total(pred, y, names))
+
+
+def test_mutual_heads_match_train_ende2():
+    pred, pred_mo, y = random_poses(2), random_poses(3), random_poses(4)
+    loss_fn = PoseLossBundle.from_args(ARGS, bone_length=True, mutual=True)
+    total, components = loss_fn((pred, pred_mo), y)
+
+    for name, reference in REFERENCE_TERMS.items():
+        assert_close(components[name], reference(pred, y), msg=name)
+        assert_close(components[name + '_mo'], reference(pred_mo, y), msg=name + '_mo')
+    olm = loss_online_mutual(pred, pred_mo, y)
+    assert_close(components['online_mutual'], olm)
+
+    expected = ARGS.lambda_org * head_total(pred, y, TERM_LAMBDAS) + \
+        ARGS.lambda_mo * head_total(pred_mo, y, TERM_LAMBDAS) + ARGS.lambda_olm * olm
+    assert_close(total, expected)
+
+
+def test_zero_weight_terms_are_skipped():
+    args = SimpleNamespace(**{**vars(ARGS), 'lambda_a': 0.0, 'lambda_av': 0.0})
+    pred, y = random_poses(5), random_poses(6)
+    total, components = PoseLossBundle.from_args(args)(pred, y)
+    names = ['3d_pose', '3d_scale', '3d_velocity', 'lv', 'lg']
+    assert set(components) == set(names)
+    assert_close(total, head_total(pred, y, names))
@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+import torch
+
+from utils.data import split_clips
+from utils.sequence_data import SequenceMotionDataset3D, sequence_windows
+
+N_JOINTS = 17
+
+
+def synthetic_sequences(lengths):
+    """Per-frame source names and 2D/3D data whose values encode the frame index."""
+    sources = [f's_{seq:02d}_act_01_subact_01_cam_01' for seq, length in enumerate(lengths) for _ in range(length)]
+    frames = np.arange(len(sources), dtype=np.float32)
+    data_2d = np.stack([frames, -frames, frames / 2], axis=-1)[:, None, :].repeat(N_JOINTS, axis=1)
+    data_3d = data_2d + 0.5
+    return sources, data_2d, data_3d
+
+
+@pytest.mark.parametrize('lengths', [
+    [30, 7, 50, 12, 25],
+    [9, 40, 10, 3],  # Short first and last sequences; split_clips drops the short last one
+    [64],
+])
+@pytest.mark.parametrize('n_frames, stride', [(10, 3), (10, 10), (12, 4)])
+def test_default_windows_match_split_clips(lengths, n_frames, stride):
+    sources, data_2d, data_3d = synthetic_sequences(lengths)
+    clips = split_clips(sources, n_frames, stride)
+    dataset = SequenceMotionDataset3D({}, data_2d, data_3d, sources, n_frames=n_frames, stride=stride)
+
+    assert len(dataset) == len(clips)
+    for index, clip in enumerate(clips):
+        motion_2d, motion_3d = dataset[index]
+        torch.testing.assert_close(motion_2d, torch.FloatTensor(data_2d[np.asarray(clip)]))
+        torch.testing.assert_close(motion_3d, torch.FloatTensor(data_3d[np.asarray(clip)]))
+
+
+def test_random_offset_stays_in_its_sequence():
+    sources, data_2d, data_3d = synthetic_sequences([30, 7, 50, 12, 25])
+    dataset = SequenceMotionDataset3D({}, data_2d, data_3d, sources, n_frames=10, stride=3, random_offset=True)
+    _, window_sequences, seq_starts, seq_ends = sequence_windows(sources, 10, 3)
+    np.random.seed(0)
+    for index in range(len(dataset)):
+        frames = np.asarray(dataset[index][1][:, 0, 0] - 0.5, dtype=int)
+        seq = window_sequences[index]
+        assert len(frames) == 10
+        assert seq_starts[seq] <= frames.min() and frames.max() < seq_ends[seq]
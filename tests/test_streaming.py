@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+import torch
+from torch import nn
+
+from utils.streaming import StreamingPoseEstimator
+
+N_JOINTS = 17
+N_FRAMES = 16
+
+
+class ToyTemporalLifter(nn.Module):
+    """Mixes frames and channels, so every output frame depends on the whole window and its order."""
+    def __init__(self, n_frames=N_FRAMES):
+        super().__init__()
+        self.temporal = nn.Parameter(torch.randn(n_frames, n_frames) / n_frames)
+        self.channels = nn.Linear(3, 3)
+
+    def forward(self, x):
+        return self.channels(torch.einsum('st,ntjc->nsjc', self.temporal, x))
+
+
+def full_window_reference(model, keypoints, stride):
+    """
+    Pose of every frame from a full-window pass over the frames up to the last frame of its stride group
+    (or of the sequence), with the first frame repeated before the start, as the estimator emits it.
+    """
+    n_total = len(keypoints)
+    poses = []
+    with torch.no_grad():
+        for frame in range(n_total):
+            end = min((frame // stride + 1) * stride, n_total) - 1
+            indices = np.clip(np.arange(end - N_FRAMES + 1, end + 1), 0, None)
+            output = model(torch.from_numpy(keypoints[indices][None]))[0]
+            poses.append(output[N_FRAMES - 1 - (end - frame)].numpy())
+    return np.stack(poses)
+
+
+@pytest.mark.parametrize('stride', [1, 4, 5, N_FRAMES])
+@pytest.mark.parametrize('batch_size', [1, 3])
+def test_streamed_poses_match_full_windows(stride, batch_size):
+    torch.manual_seed(0)
+    model = ToyTemporalLifter().eval()
+    keypoints = np.random.default_rng(stride).normal(size=(3 * N_FRAMES + 7, N_JOINTS, 3)).astype(np.float32)
+
+    estimator = StreamingPoseEstimator(model, n_frames=N_FRAMES, stride=stride, batch_size=batch_size)
+    poses = estimator.replay(keypoints)
+
+    assert poses.shape == (len(keypoints), N_JOINTS, 3)
+    np.testing.assert_allclose(poses, full_window_reference(model, keypoints, stride), rtol=1e-5, atol=1e-5)
+    assert estimator.latency_report()['frames'] == len(keypoints)
+
+
+def test_push_returns_the_last_emitted_pose():
+    torch.manual_seed(0)
+    model = ToyTemporalLifter().eval()
+    keypoints = np.random.default_rng(0).normal(size=(10, N_JOINTS, 3)).astype(np.float32)
+    estimator = StreamingPoseEstimator(model, n_frames=N_FRAMES, stride=4)
+    returned = [estimator.push(frame) for frame in keypoints]
+
+    assert [pose is not None for pose in returned] == [(frame + 1) % 4 == 0 for frame in range(10)]
+    reference = full_window_reference(model, keypoints, 4)
+    np.testing.assert_allclose(returned[7], reference[7], rtol=1e-5, atol=1e-5)
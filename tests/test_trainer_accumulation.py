@@ -0,0 +1,123 @@
+import contextlib
+import copy
+
+import pytest
+import torch
+from easydict import EasyDict
+from torch import nn
+
+import utils.trainer
+from utils.learning import AverageMeter
+from utils.precision import make_grad_scaler
+from utils.trainer import Trainer
+
+N_JOINTS = 17
+N_FRAMES = 9
+BATCH_SIZE = 4
+
+
+def make_args(accumulation_steps, ema_decay=0.0):
+    # loss_limb_var is a statistic of the whole batch, not a mean of per-sample terms, so it cannot accumulate exactly
+    return EasyDict(flip=False, root_rel=True, accumulation_steps=accumulation_steps, ema_decay=ema_decay,
+                    lambda_scale=0.5, lambda_3d_velocity=20.0, lambda_lv=0.0, lambda_lg=0.4, lambda_a=0.6,
+                    lambda_av=0.7)
+
+
+class ToyLifter(nn.Module):
+    def __init__(self):
+        super().__init__()
+        self.joints = nn.Linear(N_JOINTS, N_JOINTS)
+        self.channels = nn.Linear(3, 3)
+
+    def forward(self, x):
+        return self.channels(self.joints(x.transpose(-1, -2)).transpose(-1, -2))
+
+
+class RecordingSGD(torch.optim.SGD):
+    """SGD that keeps a copy of the gradients of every step."""
+    def __init__(self, params, lr=0.1):
+        super().__init__(params, lr=lr)
+        self.step_grads = []
+
+    def step(self, closure=None):
+        self.step_grads.append([param.grad.clone() for group in self.param_groups for param in group['params']])
+        return super().step(closure)
+
+
+class FakeDDP(nn.Module):
+    """Stands in for DistributedDataParallel and records whether every forward pass runs under no_sync()."""
+    def __init__(self, module):
+        super().__init__()
+        self.module = module
+        self.syncing = True
+        self.forward_syncs = []
+
+    def forward(self, x):
+        self.forward_syncs.append(self.syncing)
+        return self.module(x)
+
+    @contextlib.contextmanager
+    def no_sync(self):
+        self.syncing = False
+        try:
+            yield
+        finally:
+            self.syncing = True
+
+
+def random_batches(n_batches, seed=0):
+    generator = torch.Generator().manual_seed(seed)
+    return [(torch.randn(BATCH_SIZE, N_FRAMES, N_JOINTS, 3, generator=generator),
+             torch.randn(BATCH_SIZE, N_FRAMES, N_JOINTS, 3, generator=generator)) for _ in range(n_batches)]
+
+
+def merge(batches):
+    return torch.cat([x for x, _ in batches]), torch.cat([y for _, y in batches])
+
+
+def train_epoch(model, batches, accumulation_steps, ema_decay=0.0):
+    trainer = Trainer(make_args(accumulation_steps, ema_decay), 'cpu')
+    trainer.attach_ema(model)
+    optimizer = RecordingSGD(model.parameters())
+    losses = {name: AverageMeter() for name in trainer.loss_names()}
+    trainer.train_one_epoch(model, batches, optimizer, make_grad_scaler(trainer.precision, 'cpu'), losses)
+    return trainer, optimizer
+
+
+def assert_same_tensors(actual, expected):
+    assert len(actual) == len(expected)
+    for actual_tensor, expected_tensor in zip(actual, expected):
+        torch.testing.assert_close(actual_tensor, expected_tensor, rtol=1e-5, atol=1e-6)
+
+
+@pytest.mark.parametrize('accumulation_steps, groups', [
+    (3, [[0, 1, 2]]),
+    (3, [[0, 1, 2], [3, 4]]),  # The short last group is normalized by its own size
+    (2, [[0, 1], [2, 3], [4, 5], [6]]),
+])
+def test_accumulated_steps_match_merged_batches(accumulation_steps, groups):
+    torch.manual_seed(0)
+    model = ToyLifter()
+    reference = copy.deepcopy(model)
+    batches = random_batches(sum(len(group) for group in groups))
+
+    trainer, optimizer = train_epoch(model, batches, accumulation_steps, ema_decay=0.9)
+    reference_trainer, reference_optimizer = train_epoch(
+        reference, [merge([batches[i] for i in group]) for group in groups], 1, ema_decay=0.9)
+
+    assert len(optimizer.step_grads) == len(groups)
+    for grads, reference_grads in zip(optimizer.step_grads, reference_optimizer.step_grads):
+        assert_same_tensors(grads, reference_grads)
+    assert_same_tensors(list(model.parameters()), list(reference.parameters()))
+    assert trainer.ema.num_updates == len(groups)
+    assert_same_tensors(trainer.ema.shadow_params, reference_trainer.ema.shadow_params)
+
+
+def test_intermediate_batches_skip_the_gradient_sync(monkeypatch):
+    monkeypatch.setattr(utils.trainer, 'DistributedDataParallel', FakeDDP)
+    torch.manual_seed(0)
+    model = FakeDDP(ToyLifter())
+    _, optimizer = train_epoch(model, random_batches(5), accumulation_steps=3)
+
+    assert model.forward_syncs == [False, False, True, False, True]
+    assert len(optimizer.step_grads) == 2
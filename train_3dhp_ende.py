@@ -9,17 +9,24 @@ import wandb
 from torch import optim
 from tqdm import tqdm
 
-from loss.pose3d import loss_mpjpe, n_mpjpe, loss_velocity, loss_limb_var, loss_limb_gt, loss_angle, \
-    loss_angle_velocity, bone_len_loss, loss_online_mutual
+from loss.bundle import PoseLossBundle
 from utils.data import denormalize
+from utils.inference import flip_inference
 from data.reader.motion_dataset import MPI3DHP, Fusion
 from utils.tools import set_random_seed, get_config, print_args, create_directory_if_not_exists
 from torch.utils.data import DataLoader
 
 from utils.learning import load_model, AverageMeter, decay_lr_exponentially
+from utils.meters import LossAccumulator
+from utils.precision import get_precision, autocast, make_grad_scaler
+from utils.distributed import init_distributed_mode, is_main_process, wrap_model, eval_model, make_sampler, \
+    broadcast_object, model_state_dict, load_model_state_dict
 from utils.tools import count_param_numbers
+from utils.checkpoint import CheckpointManager
+from utils.compile import compile_model
+from utils.grad_checkpoint import grad_checkpoint_from_args
+from utils.eval_3dhp import SequenceResults, evaluate_3dhp, print_3dhp_metrics, metrics_log
 from utils.utils_3dhp import *
-from sklearn.metrics import auc
 
 
 def parse_args():
@@ -37,232 +44,136 @@ def parse_args():
     parser.add_argument('--wandb-run-id', default=None, type=str)
     parser.add_argument('--resume', action='store_true')
     parser.add_argument('--eval-only', action='store_true')
+    parser.add_argument('--device', default=None, type=str, help='cuda or cpu (default: cuda if available)')
     opts = parser.parse_args()
     return opts
 
 
-def train_one_epoch(args, model, train_loader, optimizer, losses):
+def train_one_epoch(args, model, train_loader, optimizer, device, losses, scaler):
     model.train()
+    precision = get_precision(args)
+    accumulator = LossAccumulator(losses)
+    loss_fn = PoseLossBundle.from_args(args, bone_length=True, mutual=True)
     for x, y in tqdm(train_loader):
         batch_size = x.shape[0]
-        if torch.cuda.is_available():
-            x, y = x.cuda(), y.cuda()
+        x, y = x.to(device, non_blocking=True), y.to(device, non_blocking=True)
 
-        pred, pred_mo = model(x)  # (N, T, 17, 3)
+        with autocast(precision, device):
+            pred, pred_mo = model(x)  # (N, T, 17, 3)
 
         optimizer.zero_grad()
 
-        loss_3d_pos = loss_mpjpe(pred, y)
-        loss_3d_scale = n_mpjpe(pred, y)
-        loss_3d_velocity = loss_velocity(pred, y)
-        loss_lv = loss_limb_var(pred)
-        loss_lg = loss_limb_gt(pred, y)
-        loss_a = loss_angle(pred, y)
-        loss_av = loss_angle_velocity(pred, y)
-        loss_bonelen = bone_len_loss(pred, y)
-        loss_olm = loss_online_mutual(pred, pred_mo, y)
-
-        loss_3d_pos_mo = loss_mpjpe(pred_mo, y)
-        loss_3d_scale_mo = n_mpjpe(pred_mo, y)
-        loss_3d_velocity_mo = loss_velocity(pred_mo, y)
-        loss_lv_mo = loss_limb_var(pred_mo)
-        loss_lg_mo = loss_limb_gt(pred_mo, y)
-        loss_a_mo = loss_angle(pred_mo, y)
-        loss_av_mo = loss_angle_velocity(pred_mo, y)
-        loss_bonelen_mo = bone_len_loss(pred_mo, y)
-
-
-
-
-        loss_total = args.lambda_org * \
-                    (loss_3d_pos + \
-                    args.lambda_scale * loss_3d_scale + \
-                    args.lambda_3d_velocity * loss_3d_velocity + \
-                    args.lambda_lv * loss_lv + \
-                    args.lambda_lg * loss_lg + \
-                    args.lambda_a * loss_a + \
-                    args.lambda_av * loss_av + \
-                    args.lambda_bone_length * loss_bonelen) + \
-                    args.lambda_mo * \
-                    (loss_3d_pos_mo + \
-                    args.lambda_scale * loss_3d_scale_mo + \
-                    args.lambda_3d_velocity * loss_3d_velocity_mo + \
-                    args.lambda_lv * loss_lv_mo + \
-                    args.lambda_lg * loss_lg_mo + \
-                    args.lambda_a * loss_a_mo + \
-                    args.lambda_av * loss_av_mo + \
-                    args.lambda_bone_length * loss_bonelen_mo) + \
-                    args.lambda_olm * loss_olm
-
-        losses['3d_pose'].update(loss_3d_pos.item(), batch_size)
-        losses['3d_scale'].update(loss_3d_scale.item(), batch_size)
-        losses['3d_velocity'].update(loss_3d_velocity.item(), batch_size)
-        losses['lv'].update(loss_lv.item(), batch_size)
-        losses['lg'].update(loss_lg.item(), batch_size)
-        losses['angle'].update(loss_a.item(), batch_size)
-        losses['angle_velocity'].update(loss_av.item(), batch_size)
-        losses['bone_length'].update(loss_bonelen.item(), batch_size)
-
-        losses['3d_pose_mo'].update(loss_3d_pos_mo.item(), batch_size)
-        losses['3d_scale_mo'].update(loss_3d_scale_mo.item(), batch_size)
-        losses['3d_velocity_mo'].update(loss_3d_velocity_mo.item(), batch_size)
-        losses['lv_mo'].update(loss_lv_mo.item(), batch_size)
-        losses['lg_mo'].update(loss_lg_mo.item(), batch_size)
-        losses['angle_mo'].update(loss_a_mo.item(), batch_size)
-        losses['angle_velocity_mo'].update(loss_av_mo.item(), batch_size)
-        losses['bone_length_mo'].update(loss_bonelen_mo.item(), batch_size)
-
-        losses['online_mutual'].update(loss_olm.item(), batch_size)  
-        losses['total'].update(loss_total.item(), batch_size)
-
-
-        losses['total'].update(loss_total.item(), batch_size)
-
-        loss_total.backward()
-        optimizer.step()
+        loss_total, loss_terms = loss_fn((pred, pred_mo), y)
 
+        accumulator.update({**loss_terms, 'total': loss_total}, batch_size)
+
+        scaler.scale(loss_total).backward()
+        scaler.step(optimizer)
+        scaler.update()
+    accumulator.flush()
 
-def input_augmentation(input_2D, model, joints_left, joints_right):
-    N, _, T, J, C = input_2D.shape 
 
+def input_augmentation(input_2D, model, joints_left, joints_right):
     input_2D_flip = input_2D[:, 1]
     input_2D_non_flip = input_2D[:, 0]
 
-    output_3D_flip, output_3D_flip_mo = model(input_2D_flip)
-
-    output_3D_flip[..., 0] *= -1
-    output_3D_flip_mo[..., 0] *= -1
-
-    output_3D_flip[:, :, joints_left + joints_right, :] = output_3D_flip[:, :, joints_right + joints_left, :]
-    output_3D_flip_mo[:, :, joints_left + joints_right, :] = output_3D_flip_mo[:, :, joints_right + joints_left, :]
-
-
-    output_3D_non_flip, output_3D_non_flip_mo = model(input_2D_non_flip)
-
-    output_3D = (output_3D_non_flip + output_3D_flip) / 2
-    output_3D_mo = (output_3D_non_flip_mo + output_3D_flip_mo) / 2
-
-    input_2D = input_2D_non_flip
+    output_3D, output_3D_mo = flip_inference(model, input_2D_non_flip, input_2D_flip, joints_left, joints_right)
 
-    return input_2D, output_3D, output_3D_mo
+    return input_2D_non_flip, output_3D, output_3D_mo
 
-def evaluate(model, test_loader, n_frames, res):
+def evaluate(model, test_loader, n_frames, heads=('org', 'mo'), device='cpu', precision='fp32'):
+    """
+    Scores every head in `heads` ('org', 'mo' and 'avg', the average of both) from a single inference pass.
+    Returns a dict mapping every head to its (metrics, data_inference), see utils.eval_3dhp.evaluate_3dhp.
+    """
+    model = eval_model(model)
     model.eval()
     joints_left = [5, 6, 7, 11, 12, 13]
     joints_right = [2, 3, 4, 8, 9, 10]
 
-    data_inference = {}
-    error_sum_test = AccumLoss()
-    err_list = np.zeros((128, 1, 17))
-
-    k=0
-    ooccseqerr=0
-    l=0
+    results = {res: SequenceResults(test_loader.dataset, test_loader.sampler) for res in heads}
     for data in tqdm(test_loader, 0):
         batch_cam, gt_3D, input_2D, seq, scale, bb_box = data
         # for s in seq:
         #     if s == 'TS5':
         #         print(s)
-        [input_2D, gt_3D, batch_cam, scale, bb_box] = get_variable('test', [input_2D, gt_3D, batch_cam, scale, bb_box])
+        input_2D, gt_3D, scale = [t.to(device, non_blocking=True).float() for t in (input_2D, gt_3D, scale)]
         N = input_2D.size(0)
 
         out_target = gt_3D.clone().view(N, -1, 17, 3)
         out_target[:, :, 14] = 0
-        gt_3D = gt_3D.view(N, -1, 17, 3).type(torch.cuda.FloatTensor)
 
-        input_2D, output_3D, output_3D_mo = input_augmentation(input_2D, model, joints_left, joints_right)
+        with autocast(precision, device):
+            input_2D, output_3D, output_3D_mo = input_augmentation(input_2D, model, joints_left, joints_right)
 
-        output_3D = output_3D * scale.unsqueeze(-1).unsqueeze(-1).unsqueeze(-1).repeat(1, output_3D.size(1), 17, 3)
-        output_3D_mo = output_3D_mo * scale.unsqueeze(-1).unsqueeze(-1).unsqueeze(-1).repeat(1, output_3D_mo.size(1), 17, 3)
-        
         pad = (n_frames - 1) // 2
-        if res == 'org':
-            pred_out = output_3D[:, pad].unsqueeze(1)
-        if res == 'mo':
-            pred_out = output_3D_mo[:, pad].unsqueeze(1)
-    
-        pred_out[..., 14, :] = 0
-        pred_out = denormalize(pred_out, seq)
-
-        pred_out = pred_out - pred_out[..., 14:15, :] # Root-relative prediction
-        
-        inference_out = pred_out + out_target[..., 14:15, :] # final inference (for PCK and AUC) is not root relative
-
-        out_target = out_target - out_target[..., 14:15, :] # Root-relative prediction
-
-        joint_error_test = mpjpe_cal(pred_out, out_target)[0].item()
-        err = mpjpe_cal(pred_out, out_target)[1]
-        err = err.cpu().numpy()
-        meanerr = np.mean(err, axis=2)
-        for s in seq:
-            if s == 'TS6':
-                print(meanerr)
-                ooccseqerr += meanerr[0]
-                l+=1
-        if k==0:
-            err_list = err
-        else:
-            # err_list = torch.cat((err_list, err), dim=0)
-            err_list = np.concatenate((err_list, err), axis=0)
-        k+=1
-
-        for seq_cnt in range(len(seq)):
-            seq_name = seq[seq_cnt]
-            if seq_name in data_inference:
-                data_inference[seq_name] = np.concatenate(
-                    (data_inference[seq_name], inference_out[seq_cnt].permute(2, 1, 0).cpu().numpy()), axis=2)
-            else:
-                data_inference[seq_name] = inference_out[seq_cnt].permute(2, 1, 0).cpu().numpy()
-        
-        error_sum_test.update(joint_error_test * N, N)
-    print('seq5 error:', ooccseqerr/l)
-    for seq_name in data_inference.keys():
-        data_inference[seq_name] = data_inference[seq_name][:, :, None, :]
-    
-    print(f'Protocol #1 Error (MPJPE): {error_sum_test.avg:.2f} mm')
+        outputs = {'org': output_3D[:, pad], 'mo': output_3D_mo[:, pad]}
+        if 'avg' in heads:
+            outputs['avg'] = (outputs['org'] + outputs['mo']) / 2
+        target_root = out_target[..., 14:15, :]
+        out_target = out_target - target_root # Root-relative prediction
+
+        for res in heads:
+            pred_out = outputs[res] * scale.unsqueeze(-1).unsqueeze(-1).repeat(1, 17, 3)
+            pred_out = pred_out.unsqueeze(1)
+
+            pred_out[..., 14, :] = 0
+            pred_out = denormalize(pred_out, seq)
+
+            pred_out = pred_out - pred_out[..., 14:15, :] # Root-relative prediction
+
+            inference_out = pred_out + target_root # final inference (for PCK and AUC) is not root relative
+
+            err = mpjpe_cal(pred_out, out_target)[1]
+            err = err.cpu().numpy()
 
-    err_list = err_list.flatten()
-    calculate_auc(err_list)
+            results[res].add(seq, err.reshape(N, 17), inference_out[:, 0].cpu().numpy())
 
+    # Merge the test set shards of all ranks and compute the metrics on the main process
+    for res in heads:
+        results[res].gather()
+    if not is_main_process():
+        return broadcast_object(None)
 
-    return error_sum_test.avg, data_inference
+    scores = {}
+    for res in heads:
+        metrics = evaluate_3dhp(results[res])
+        print(f'[INFO] Head {res}')
+        print_3dhp_metrics(metrics)
+        print(f"Protocol #1 Error (MPJPE): {metrics['all']['mpjpe']:.2f} mm")
+        scores[res] = (metrics, results[res].inference)
 
-def calculate_auc(mpjpe_errors):
-    thresholds = np.linspace(0, 150, num=151)
-    # Calculate TPR for each threshold
-    tpr = [np.mean(mpjpe_errors <= threshold) for threshold in thresholds]
-    # Calculate the AUC
-    area_under_curve = auc(thresholds, tpr)
-    # Print the AUC
-    print("AUC:", area_under_curve / 150)
+    broadcast_object({res: (metrics, None) for res, (metrics, _) in scores.items()})
+    return scores
 
-    mask = mpjpe_errors < 150
-    count = np.sum(mask)
-    total = len(mpjpe_errors)
-    pck = (count/total)*100
+checkpoints = CheckpointManager()  # Checkpoints and .mat files are written in the background
 
-    print('PCK:', pck)
 
 def save_checkpoint(checkpoint_path, epoch, lr, optimizer, model, min_mpjpe, wandb_id):
+    if not is_main_process():
+        return
     if not os.path.exists('checkpoint'):
         os.makedirs('checkpoint')
-    torch.save({
+    checkpoints.save(checkpoint_path, {
         'epoch': epoch + 1,
         'lr': lr,
         'optimizer': optimizer.state_dict(),
-        'model': model.state_dict(),
+        'model': model_state_dict(model),
         'min_mpjpe': min_mpjpe,
         'wandb_id': wandb_id,
-    }, checkpoint_path)
+    })
 
 def save_data_inference(path, data_inference, latest):
+    if not is_main_process():
+        return
     if latest:
         mat_path = os.path.join(path, 'inference_data.mat')
     else:
         mat_path = os.path.join(path, 'inference_data_best.mat')
-    scio.savemat(mat_path, data_inference)
+    checkpoints.save(mat_path, data_inference, writer=lambda file, data: scio.savemat(file, data, appendmat=False))
 
 def train(args, opts):
+    device = init_distributed_mode(opts.device)
     print_args(args)
     create_directory_if_not_exists(opts.new_checkpoint)
 
@@ -271,16 +182,17 @@ def train(args, opts):
 
     common_loader_params = {
         'num_workers': opts.num_cpus - 1,
-        'pin_memory': True,
+        'pin_memory': torch.device(device).type == 'cuda',
         'prefetch_factor': (opts.num_cpus - 1) // 3,
         'persistent_workers': True
     }
-    train_loader = DataLoader(train_dataset, shuffle=True, batch_size=args.batch_size, **common_loader_params)
-    test_loader = DataLoader(test_dataset, shuffle=False, batch_size=args.test_batch_size, **common_loader_params)
-    model = load_model(args)
-    if torch.cuda.is_available():
-        model = torch.nn.DataParallel(model)
-        model = model.cuda()
+    train_sampler = make_sampler(train_dataset, train=True)
+    train_loader = DataLoader(train_dataset, shuffle=train_sampler is None, sampler=train_sampler,
+                              batch_size=args.batch_size, **common_loader_params)
+    test_loader = DataLoader(test_dataset, shuffle=False, sampler=make_sampler(test_dataset, train=False),
+                             batch_size=args.test_batch_size, **common_loader_params)
+    model = wrap_model(grad_checkpoint_from_args(load_model(args), args), device)
+    compile_model(model, args, device, inference=False)  # The wrapper, in place: checkpoints keep their layout
 
     n_params = count_param_numbers(model)
     print(f"[INFO] Number of parameters: {n_params:,}")
@@ -289,17 +201,19 @@ def train(args, opts):
     optimizer = optim.Adam(filter(lambda p: p.requires_grad, model.parameters()),
                             lr=lr,
                             amsgrad=True)
+    scaler = make_grad_scaler(get_precision(args), device)
     lr_decay = args.lr_decay
     epoch_start = 0
     min_mpjpe = float('inf')  # Used for storing the best model
     min_mpjpe_mo = float('inf')
+    heads = ('org', 'mo', 'avg') if args.get('eval_average_head', False) else ('org', 'mo')
     wandb_id = opts.wandb_run_id if opts.wandb_run_id is not None else wandb.util.generate_id()
 
     if opts.checkpoint:
         checkpoint_path = os.path.join(opts.checkpoint, opts.checkpoint_file if opts.checkpoint_file else "latest_epoch.pth.tr")
         if os.path.exists(checkpoint_path):
             checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
-            model.load_state_dict(checkpoint['model'], strict=True)
+            load_model_state_dict(model, checkpoint['model'])
 
             if opts.resume:
                 lr = checkpoint['lr']
@@ -314,13 +228,13 @@ def train(args, opts):
 
     if not opts.eval_only:
         if opts.resume:
-            if opts.use_wandb:
+            if opts.use_wandb and is_main_process():
                 wandb.init(id=wandb_id,
                         project='MotionMetaFormer',
                         resume="must",
                         settings=wandb.Settings(start_method='fork'))
         else:
-            if opts.use_wandb:
+            if opts.use_wandb and is_main_process():
                 print(f"Run ID: {wandb_id}")
                 wandb.init(id=wandb_id,
                         name=opts.wandb_name,
@@ -342,18 +256,21 @@ def train(args, opts):
     for epoch in range(epoch_start, args.epochs):
         if opts.eval_only:
             with torch.no_grad():
-                evaluate(model, test_loader, args.n_frames, 'org')
-                evaluate(model, test_loader, args.n_frames, 'mo')
+                evaluate(model, test_loader, args.n_frames, heads, device, get_precision(args))
                 exit()
             
         print(f"[INFO] epoch {epoch}")
+        if train_sampler is not None:
+            train_sampler.set_epoch(epoch)
         loss_names = ['3d_pose', '3d_scale', '2d_proj', 'lg', 'lv', '3d_velocity', 'angle', 'angle_velocity', 'bone_length', 'online_mutual','3d_pose_mo', '3d_scale_mo', '2d_proj_mo', 'lg_mo', 'lv_mo', '3d_velocity_mo', 'angle_mo', 'angle_velocity_mo', 'bone_length_mo', 'total']
         losses = {name: AverageMeter() for name in loss_names}
     
-        train_one_epoch(args, model, train_loader, optimizer, losses)
+        train_one_epoch(args, model, train_loader, optimizer, device, losses, scaler)
         with torch.no_grad():
-            mpjpe, data_inference = evaluate(model, test_loader, args.n_frames, 'org')
-            mpjpe_mo, data_inference_mo = evaluate(model, test_loader, args.n_frames, 'mo')
+            results = evaluate(model, test_loader, args.n_frames, heads, device, get_precision(args))
+        metrics, data_inference = results['org']
+        metrics_mo, data_inference_mo = results['mo']
+        mpjpe, mpjpe_mo = metrics['all']['mpjpe'], metrics_mo['all']['mpjpe']
 
         if mpjpe < min_mpjpe:
             min_mpjpe = mpjpe
@@ -366,7 +283,7 @@ def train(args, opts):
         save_checkpoint(checkpoint_path_latest, epoch, lr, optimizer, model, min_mpjpe, wandb_id)
         save_data_inference(opts.new_checkpoint, data_inference, latest=True)
 
-        if opts.use_wandb:
+        if opts.use_wandb and is_main_process():
             wandb.log({
                 'lr': lr,
                 'train/loss_3d_pose': losses['3d_pose'].avg,
@@ -378,13 +295,15 @@ def train(args, opts):
                 'train/loss_angle': losses['angle'].avg,
                 'train/angle_velocity': losses['angle_velocity'].avg,
                 'train/total': losses['total'].avg,
-                'eval/mpjpe': mpjpe,
                 'eval/min_mpjpe': min_mpjpe,
+                **metrics_log(metrics),
+                **{key: value for res in heads if res != 'org' for key, value in metrics_log(results[res][0], f'_{res}').items()},
             }, step=epoch + 1)
 
         lr = decay_lr_exponentially(lr, lr_decay, optimizer)
 
-    if opts.use_wandb:
+    checkpoints.wait()
+    if opts.use_wandb and is_main_process():
         artifact = wandb.Artifact(f'model', type='model')
         artifact.add_file(checkpoint_path_latest)
         artifact.add_file(checkpoint_path_best)
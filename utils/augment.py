@@ -0,0 +1,90 @@
+import torch
+import torch.nn.functional as F
+
+from utils.data import flip_data
+from utils.distributed import get_rank
+from utils.tools import read_pkl
+
+
+class BatchAugmenter(object):
+    """
+    Training augmentation of whole batches on the training device: random flipping, synthetic 2D noise
+    (noise_path, d2c_params_path) and joint/temporal masking (mask_ratio, mask_T_ratio).
+    It replaces the flipping of the datasets and Augmenter2D, so DataLoader workers only read data.
+    Random numbers come from a generator of its own on `device`, seeded from torch.initial_seed() and the rank,
+    so the augmentation does not consume the global RNG streams.
+
+    Noise and masking follow Augmenter2D: noise keyframes are interpolated over time, the confidence channel is
+    recomputed from the noise magnitude, and the temporal mask is shared by the whole batch.
+    augment_2d: enables noise and masking; trainers that never used Augmenter2D only flip.
+    """
+    num_Kframes = 27
+    noise_std = 0.002
+
+    def __init__(self, args, device, augment_2d=True, seed=None):
+        self.device = device
+        self.flip = args.flip
+        self.mask_ratio = args.get('mask_ratio', 0)
+        self.mask_T_ratio = args.get('mask_T_ratio', 0)
+        self.mask = self.mask_ratio > 0 and self.mask_T_ratio > 0
+        self.noise = args.get('noise', False)
+        if not augment_2d:
+            if self.mask or self.noise:
+                print("[WARN] noise and mask_ratio are ignored by this trainer, only flipping is applied")
+            self.mask = self.noise = False
+        if self.noise:
+            self.d2c_params = read_pkl(args.d2c_params_path)
+            noise = torch.load(args.noise_path)
+            self.noise_mean = noise['mean'].float().to(device)
+            self.noise_std_keyframes = noise['std'].float().to(device)
+            self.noise_weight = noise['weight'][:, None].float().to(device)
+            self.uniform_range = noise.get('uniform_range', 0.06)
+
+        self.generator = torch.Generator(device=device)
+        seed = torch.initial_seed() if seed is None else seed
+        self.generator.manual_seed((seed + get_rank()) % 2 ** 63)
+
+    def rand(self, *shape):
+        return torch.rand(shape, generator=self.generator, device=self.device)
+
+    def randn(self, *shape):
+        return torch.randn(shape, generator=self.generator, device=self.device)
+
+    def add_flip(self, x, y):
+        """Mirrors a random half of the samples, input and label alike."""
+        flipped = self.rand(x.shape[0]) < 0.5
+        x[flipped] = flip_data(x[flipped])
+        y[flipped] = flip_data(y[flipped])
+        return x, y
+
+    def add_noise(self, x):
+        """x: (N, T, J, C) -> (N, T, J, 3) noisy 2D with the matching confidence"""
+        x = x[..., :2]
+        N, T, J, _ = x.shape
+        sel = self.rand(N, self.num_Kframes, J, 1)
+        gaussian_sample = self.randn(N, self.num_Kframes, J, 2) * self.noise_std_keyframes + self.noise_mean
+        uniform_sample = (self.rand(N, self.num_Kframes, J, 2) - 0.5) * self.uniform_range
+        delta = gaussian_sample * (sel < self.noise_weight) + uniform_sample * (sel >= self.noise_weight)
+        delta = F.interpolate(delta.unsqueeze(1), [T, J, 2], mode='trilinear', align_corners=True)[:, 0]
+        delta = delta + self.randn(T, J, 2) * self.noise_std
+
+        distance = torch.norm(delta, dim=-1)
+        a, b, m, s = (self.d2c_params[key] for key in ('a', 'b', 'm', 's'))
+        conf = a / (distance + a) + b * distance + self.randn(N, T, J) * s + m
+        return torch.cat((x + delta, conf.clip(0, 1)[..., None]), dim=-1)
+
+    def add_mask(self, x):
+        N, T, J, _ = x.shape
+        mask = self.rand(N, T, J, 1) > self.mask_ratio
+        mask_T = self.rand(1, T, 1, 1) > self.mask_T_ratio
+        return x * (mask * mask_T).to(x.dtype)
+
+    def __call__(self, x, y):
+        """x: 2D input (N, T, J, C), y: 3D label (N, T, J, 3), both on `device`. Returns the augmented pair."""
+        if self.flip:
+            x, y = self.add_flip(x, y)
+        if self.noise:
+            x = self.add_noise(x)
+        if self.mask:
+            x = self.add_mask(x)
+        return x, y
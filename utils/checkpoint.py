@@ -0,0 +1,128 @@
+import atexit
+import os
+import queue
+import threading
+
+import torch
+
+from utils.distributed import is_main_process
+
+
+def to_cpu(obj):
+    """Copy of a (nested) state dict with every tensor moved to, or copied on, the CPU."""
+    if torch.is_tensor(obj):
+        return obj.detach().to('cpu', copy=True)
+    if isinstance(obj, dict):
+        return type(obj)((key, to_cpu(value)) for key, value in obj.items())
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(to_cpu(value) for value in obj)
+    return obj
+
+
+def torch_writer(path, state):
+    torch.save(state, path)
+
+
+class CheckpointManager(object):
+    """
+    Writes checkpoints on a background thread so training does not wait for the disk.
+    save() snapshots the state to CPU memory and returns; the thread writes it to a temporary file and renames it
+    into place, so a checkpoint path never holds a partially written file.
+    save_top_k() keeps only the k best checkpoints of a group by a lower-is-better score; top_k_state() and
+    restore_top_k() carry that ranking across a resume.
+    wait() blocks until everything submitted so far is on disk; it also runs at interpreter exit.
+    Only the main process writes, save() is a no-op on the other ranks.
+
+    max_pending: number of snapshots that may wait for the writer before save() blocks
+    """
+    def __init__(self, max_pending=4):
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.error = None
+        self.top_k = {}
+        self.thread = None
+        atexit.register(self.wait)
+
+    def _start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._worker, name='checkpoint-writer', daemon=True)
+            self.thread.start()
+
+    def _worker(self):
+        while True:
+            job = self.queue.get()
+            try:
+                job()
+            except Exception as e:
+                self.error = e
+            finally:
+                self.queue.task_done()
+
+    def _check(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise RuntimeError('Writing a checkpoint failed') from error
+
+    def _submit(self, job):
+        self._check()
+        self._start()
+        self.queue.put(job)
+
+    def save(self, path, state, writer=torch_writer):
+        """
+        path: destination file
+        state: object to write; its tensors are copied to CPU before save() returns
+        writer: writer(path, state) writing the file, torch.save by default
+        """
+        if not is_main_process():
+            return
+        state = to_cpu(state)
+
+        def job():
+            directory, name = os.path.split(path)
+            tmp_path = os.path.join(directory, f'.{name}.tmp')
+            writer(tmp_path, state)
+            os.replace(tmp_path, path)
+        self._submit(job)
+
+    def save_top_k(self, group, k, path, state, score, writer=torch_writer):
+        """
+        Saves the checkpoint only if its score is among the k lowest of `group` so far and removes the checkpoint
+        it pushes out of the top k. Returns True if it was saved.
+        """
+        if k <= 0:
+            return False
+        kept = self.top_k.setdefault(group, [])
+        if len(kept) >= k and score >= kept[-1][0]:
+            return False
+        kept.append((score, path))
+        kept.sort(key=lambda item: item[0])
+        self.save(path, state, writer)
+        if len(kept) > k:
+            _, removed = kept.pop()
+            if removed != path and is_main_process():
+                self._submit(lambda: os.path.exists(removed) and os.remove(removed))
+        return True
+
+    def top_k_state(self):
+        """The top-k bookkeeping, {group: [(score, path), ...]}, to store in a checkpoint and restore on resume."""
+        return {group: list(kept) for group, kept in self.top_k.items()}
+
+    def restore_top_k(self, top_k, directory, k):
+        """
+        Restores a top_k_state() when resuming, so snapshots written before count towards k and get evicted.
+        Only existing snapshots in `directory` are restored; the ones beyond the k best are removed.
+        """
+        directory = os.path.realpath(directory)
+        for group, kept in top_k.items():
+            kept = sorted((score, path) for score, path in kept
+                          if os.path.realpath(os.path.dirname(path)) == directory and os.path.exists(path))
+            self.top_k[group] = kept[:max(k, 0)]
+            for _, removed in kept[max(k, 0):]:
+                if is_main_process():
+                    self._submit(lambda removed=removed: os.path.exists(removed) and os.remove(removed))
+
+    def wait(self):
+        """Blocks until every submitted checkpoint is written."""
+        if self.thread is not None:
+            self.queue.join()
+        self._check()
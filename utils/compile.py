@@ -0,0 +1,104 @@
+import hashlib
+import os
+
+import torch
+
+COMPILE_MODES = ('none', 'compile', 'trace')
+
+
+def example_input(args, batch_size=1, device='cpu'):
+    """Fixed random input of the configured shape, used to specialize and to verify compiled models."""
+    generator = torch.Generator().manual_seed(0)
+    return torch.randn(batch_size, args.n_frames, args.num_joints, args.dim_in, generator=generator).to(device)
+
+
+def enable_compile_cache(cache_dir):
+    """Persists the torch.compile (inductor) artifacts in cache_dir, so later runs skip recompilation."""
+    os.environ.setdefault('TORCHINDUCTOR_CACHE_DIR', os.path.abspath(os.path.join(cache_dir, 'inductor')))
+    try:
+        import torch._inductor.config as inductor_config
+        inductor_config.fx_graph_cache = True
+    except (ImportError, AttributeError):
+        pass
+
+
+def traced_model(model, example, cache_dir, cache_key=None):
+    """
+    TorchScript trace of `model` for inputs shaped like `example`.
+    With a cache_key (identifying the weights), the trace is saved to cache_dir and loaded by later runs.
+    """
+    path = None
+    if cache_key is not None:
+        key = f'{cache_key}|{torch.__version__}|{example.device.type}|{tuple(example.shape)}'
+        path = os.path.join(cache_dir, f'{hashlib.sha256(key.encode()).hexdigest()}.pt')
+        if os.path.exists(path):
+            print(f"[INFO] Loading TorchScript model from {path}")
+            return torch.jit.load(path, map_location=example.device)
+
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example, check_trace=False)
+    if path is not None:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_path = os.path.join(cache_dir, f'.{os.path.basename(path)}.tmp')
+        torch.jit.save(traced, tmp_path)
+        os.replace(tmp_path, path)
+    return traced
+
+
+def max_difference(outputs, reference):
+    if not isinstance(outputs, (tuple, list)):
+        outputs, reference = (outputs,), (reference,)
+    return max((output.float() - ref.float()).abs().max().item() for output, ref in zip(outputs, reference))
+
+
+def compile_model(model, args, device, cache_key=None, inference=True):
+    """
+    Opt-in compiled execution, selected by args.compile:
+    'none': the eager model
+    'compile': torch.compile with args.compile_backend (inductor by default), specialized to the configured
+               n_frames (dynamic=False); compiled in place so state dict keys are unchanged, which training
+               (inference=False) requires. For training, pass the model as returned by wrap_model: compiling a
+               module inside DataParallel would have every replica call the compiled forward of the original
+    'trace': TorchScript trace for inference, cached on disk under cache_key; sizes the model reads in Python are
+             frozen to those of example_input
+    Artifacts are kept in args.compile_cache_dir. The compiled model is checked against the eager one on
+    example_input, in eval mode, and rejected when they differ by more than args.compile_atol.
+    """
+    mode = args.get('compile', 'none')
+    assert mode in COMPILE_MODES, f"compile must be one of {COMPILE_MODES}, got {mode}"
+    if mode == 'none':
+        return model
+    if mode == 'trace' and not inference:
+        print("[WARN] TorchScript tracing is for inference only, training runs in eager mode")
+        return model
+    cache_dir = args.get('compile_cache_dir', 'compile_cache')
+
+    training = model.training
+    model.eval()
+    example = example_input(args, device=device)
+    with torch.no_grad():
+        reference = model(example)
+
+    if mode == 'compile':
+        enable_compile_cache(cache_dir)
+        backend = args.get('compile_backend', 'inductor')
+        if hasattr(model, 'compile'):
+            model.compile(backend=backend, dynamic=False)
+            compiled = model
+        elif inference:
+            compiled = torch.compile(model, backend=backend, dynamic=False)
+        else:
+            print("[WARN] This torch version cannot compile modules in place, training runs in eager mode")
+            model.train(training)
+            return model
+    else:
+        compiled = traced_model(model, example, cache_dir, cache_key)
+
+    with torch.no_grad():
+        difference = max_difference(compiled(example), reference)
+    atol = args.get('compile_atol', 1e-4)
+    if difference > atol:
+        raise RuntimeError(f"Compiled model ({mode}) differs from eager by {difference:.2e} > {atol:.0e}")
+    print(f"[INFO] Compiled model ({mode}) matches eager within {difference:.2e}")
+    model.train(training)
+    return compiled
@@ -0,0 +1,149 @@
+import os
+from collections import OrderedDict
+
+import numpy as np
+import torch
+import torch.distributed as dist
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DistributedSampler, Sampler
+
+
+def init_distributed_mode(device=None):
+    """
+    Joins the process group when launched with torchrun (RANK, WORLD_SIZE and LOCAL_RANK are set),
+    using NCCL on GPU and gloo on CPU. Single-process runs are left untouched.
+    device: 'cuda' or 'cpu' to force a device type, by default CUDA when available
+    Returns the device this process should use.
+    """
+    use_cuda = torch.cuda.is_available() if device is None else torch.device(device).type == 'cuda'
+    if 'RANK' not in os.environ or 'WORLD_SIZE' not in os.environ:
+        return device if device is not None else ('cuda' if use_cuda else 'cpu')
+    local_rank = int(os.environ.get('LOCAL_RANK', 0))
+    if use_cuda:
+        torch.cuda.set_device(local_rank)
+        dist.init_process_group(backend='nccl')
+        device = f'cuda:{local_rank}'
+    else:
+        dist.init_process_group(backend='gloo')
+        device = 'cpu'
+    print(f"[INFO] Distributed mode: rank {get_rank()} of {get_world_size()} on {device}")
+    return device
+
+
+def is_distributed():
+    return dist.is_available() and dist.is_initialized()
+
+
+def get_rank():
+    return dist.get_rank() if is_distributed() else 0
+
+
+def get_world_size():
+    return dist.get_world_size() if is_distributed() else 1
+
+
+def is_main_process():
+    return get_rank() == 0
+
+
+def barrier():
+    if is_distributed():
+        dist.barrier()
+
+
+def wrap_model(model, device):
+    """DistributedDataParallel under torchrun, DataParallel on a single GPU process, the bare model on CPU."""
+    on_cuda = torch.device(device).type == 'cuda'
+    if is_distributed():
+        model.to(device)
+        device_ids = [torch.device(device).index] if on_cuda else None
+        return DistributedDataParallel(model, device_ids=device_ids)
+    if on_cuda:
+        model = torch.nn.DataParallel(model)
+    model.to(device)
+    return model
+
+
+def unwrap_model(model):
+    if isinstance(model, (DistributedDataParallel, torch.nn.DataParallel)):
+        return model.module
+    return model
+
+
+def eval_model(model):
+    """Evaluation runs on the local replica, so the DDP wrapper does not issue collectives per forward pass."""
+    return model.module if isinstance(model, DistributedDataParallel) else model
+
+
+def model_state_dict(model):
+    """
+    State dict in the layout written by the single-process trainers, so checkpoints saved from a DDP run
+    load into them unchanged: 'module.'-prefixed (DataParallel) when CUDA is available, bare otherwise.
+    """
+    state_dict = unwrap_model(model).state_dict()
+    if torch.cuda.is_available():
+        state_dict = OrderedDict(('module.' + key, value) for key, value in state_dict.items())
+    return state_dict
+
+
+def load_model_state_dict(model, state_dict, strict=True):
+    """Loads a checkpoint regardless of whether it was saved from a wrapped or a bare model."""
+    state_dict = OrderedDict((key[len('module.'):] if key.startswith('module.') else key, value)
+                             for key, value in state_dict.items())
+    return unwrap_model(model).load_state_dict(state_dict, strict=strict)
+
+
+class ShardedEvalSampler(Sampler):
+    """
+    Splits a test set into contiguous, non-overlapping shards, one per rank, without padding.
+    Concatenating the per-rank results in rank order restores the original dataset order.
+    """
+    def __init__(self, dataset):
+        n_samples = len(dataset)
+        shard_size = (n_samples + get_world_size() - 1) // get_world_size()
+        self.start = min(get_rank() * shard_size, n_samples)
+        self.end = min(self.start + shard_size, n_samples)
+
+    def __iter__(self):
+        return iter(range(self.start, self.end))
+
+    def __len__(self):
+        return self.end - self.start
+
+
+def make_sampler(dataset, train):
+    """Returns None outside of distributed mode, so DataLoaders keep their default sampling."""
+    if not is_distributed():
+        return None
+    if train:
+        return DistributedSampler(dataset, shuffle=True)
+    return ShardedEvalSampler(dataset)
+
+
+def gather_object(obj, dst=0):
+    """Returns the list of `obj` from every rank, in rank order, on rank dst and None on the other ranks."""
+    if not is_distributed():
+        return [obj]
+    gathered = [None] * get_world_size() if get_rank() == dst else None
+    dist.gather_object(obj, gathered, dst=dst)
+    return gathered
+
+
+def gather_predictions(results):
+    """
+    Concatenates the per-rank predictions of a ShardedEvalSampler test set along the first axis on the main
+    process. The other ranks get None, so only one copy of the full test set predictions is held.
+    """
+    if not is_distributed():
+        return results
+    shards = gather_object(results)
+    return None if shards is None else np.concatenate(shards)
+
+
+def broadcast_object(obj):
+    """Returns rank 0's `obj` on every rank."""
+    if not is_distributed():
+        return obj
+    objects = [obj]
+    dist.broadcast_object_list(objects, src=0)
+    return objects[0]
@@ -0,0 +1,51 @@
+import contextlib
+
+import torch
+
+from utils.distributed import unwrap_model
+
+
+class ModelEMA(object):
+    """
+    Exponential moving average of the model weights.
+    The shadow tensors are updated in place with fused foreach ops after every optimizer step. Buffers are not
+    averaged, they are copied. swapped() exchanges the storage of the model and shadow tensors instead of copying
+    weights, so the EMA weights are evaluated (or saved) at no cost and the training weights come back unchanged.
+
+    decay: EMA decay; the effective decay is min(decay, (1 + n) / (10 + n)) after n updates, so early training
+           weights are not dragged along for thousands of steps
+    """
+    def __init__(self, model, decay=0.999):
+        self.decay = decay
+        self.num_updates = 0
+        self.params, self.buffers = self.model_tensors(model)
+        self.shadow_params = [param.detach().clone() for param in self.params]
+        self.shadow_buffers = [buffer.detach().clone() for buffer in self.buffers]
+
+    @staticmethod
+    def model_tensors(model):
+        model = unwrap_model(model)
+        params = [param for param in model.parameters() if param.dtype.is_floating_point]
+        return params, list(model.buffers())
+
+    @torch.no_grad()
+    def update(self):
+        self.num_updates += 1
+        decay = min(self.decay, (1 + self.num_updates) / (10 + self.num_updates))
+        torch._foreach_mul_(self.shadow_params, decay)
+        torch._foreach_add_(self.shadow_params, [param.detach() for param in self.params], alpha=1 - decay)
+        for shadow, buffer in zip(self.shadow_buffers, self.buffers):
+            shadow.copy_(buffer)
+
+    def swap(self):
+        for tensor, shadow in zip(self.params + self.buffers, self.shadow_params + self.shadow_buffers):
+            tensor.data, shadow.data = shadow.data, tensor.data
+
+    @contextlib.contextmanager
+    def swapped(self):
+        """Within the context the model holds the EMA weights."""
+        self.swap()
+        try:
+            yield
+        finally:
+            self.swap()
@@ -0,0 +1,152 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from torch.utils.data import DataLoader
+
+from utils.eval_h36m import evaluate_h36m
+from utils.inference import load_inference_model
+from utils.trainer import predict_heads, AVERAGE_HEAD
+
+# Settings the raw predictions of a checkpoint depend on besides its weights
+PREDICTION_SETTINGS = ('n_frames', 'flip', 'no_conf', 'root_rel', 'gt_2d', 'precision', 'dt_file', 'subset_list')
+
+
+def file_hash(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def predict_checkpoint(args, checkpoint_path, model_key, test_dataset, device, n_heads=1, loader_workers=2):
+    """
+    Normalized test-set predictions of every output head of a checkpoint, stacked to (n_heads, n_clips, T, J, 3);
+    runs in the ensemble worker processes. The weights are loaded non-strictly, like the per-checkpoint evaluation
+    this replaced.
+    loader_workers: DataLoader worker processes; 0 inside pool workers, which are daemonic and cannot have children
+    """
+    model = load_inference_model(args, checkpoint_path, device, model_key, strict=False)
+    test_loader = DataLoader(test_dataset, batch_size=args.batch_size, shuffle=False, num_workers=loader_workers,
+                             pin_memory=torch.device(device).type == 'cuda')
+    return np.stack(predict_heads(model, test_loader, args, device, n_heads)[:n_heads])
+
+
+def _predict_worker(job):
+    return predict_checkpoint(*job)
+
+
+class EnsembleEvaluator(object):
+    """
+    Prediction-level ensembles of H36M checkpoints.
+    Every checkpoint is run over the test set once; its raw predictions are cached in cache_dir under the hash of
+    the checkpoint file and the prediction settings, so adding a checkpoint only runs the new one.
+    Missing predictions are computed in num_workers processes, spread over the visible GPUs.
+
+    The predictions of all output heads are cached, so any head can be ensembled without running a checkpoint again.
+
+    trainer: Trainer providing the evaluation settings, the output heads, the checkpoint format and the evaluation index
+    test_dataset: test set of the predictions, in the order of datareader.get_split_id()
+    head: suffix of the ensembled head, or AVERAGE_HEAD for the average of all heads. By default every checkpoint
+          uses the head whose suffix is in its file name, i.e. the head it was snapshotted for, or the first head.
+    """
+    def __init__(self, trainer, datareader, test_dataset, cache_dir, num_workers=None, head=None):
+        assert head is None or head in trainer.head_suffixes + (AVERAGE_HEAD,), f"Unknown head {head}"
+        self.trainer = trainer
+        self.head = head
+        self.args = trainer.args
+        self.datareader = datareader
+        self.test_dataset = test_dataset
+        self.cache_dir = cache_dir
+        self.devices = [f'cuda:{i}' for i in range(torch.cuda.device_count())] or ['cpu']
+        self.num_workers = len(self.devices) if num_workers is None else num_workers
+        settings = {key: self.args.get(key) for key in PREDICTION_SETTINGS}
+        settings['weights'] = 'ema'  # load_inference_model prefers the EMA weights of a checkpoint
+        settings['heads'] = list(trainer.head_suffixes)
+        settings = json.dumps(settings, sort_keys=True, default=str)
+        self.settings_hash = hashlib.sha256(settings.encode()).hexdigest()[:16]
+
+    def cache_path(self, checkpoint_path):
+        return os.path.join(self.cache_dir, f'{file_hash(checkpoint_path)}_{self.settings_hash}.npy')
+
+    def checkpoint_head(self, checkpoint_path):
+        """Head suffix ensembled for a checkpoint."""
+        if self.head is not None:
+            return self.head
+        name = os.path.basename(checkpoint_path)
+        for suffix in self.trainer.head_suffixes[1:]:
+            if suffix in name:
+                return suffix
+        return self.trainer.head_suffixes[0]
+
+    def head_predictions(self, checkpoint_path, cache_path):
+        heads = np.load(cache_path, mmap_mode='r')
+        suffix = self.checkpoint_head(checkpoint_path)
+        if suffix == AVERAGE_HEAD:
+            return self.datareader.denormalize(np.mean(heads, axis=0))
+        return self.datareader.denormalize(np.array(heads[self.trainer.head_suffixes.index(suffix)]))
+
+    def predictions(self, checkpoint_paths):
+        """Returns the denormalized predictions (n_clips, T, J, 3) of the ensembled head of each checkpoint."""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        cache_paths = [self.cache_path(path) for path in checkpoint_paths]
+        missing = [(path, cache_path) for path, cache_path in zip(checkpoint_paths, cache_paths)
+                   if not os.path.exists(cache_path)]
+        print(f"[INFO] {len(checkpoint_paths) - len(missing)} cached predictions, {len(missing)} to compute")
+
+        model_key = self.trainer.checkpoint_format.model_key
+        parallel = self.num_workers > 1 and len(missing) > 1
+        n_heads = len(self.trainer.head_suffixes)
+        jobs = [(self.args, path, model_key, self.test_dataset, self.devices[i % len(self.devices)], n_heads,
+                 0 if parallel else 2)
+                for i, (path, _) in enumerate(missing)]
+        if parallel:
+            with mp.get_context('spawn').Pool(min(self.num_workers, len(jobs))) as pool:
+                results = pool.map(_predict_worker, jobs)
+        else:
+            results = [_predict_worker(job) for job in jobs]
+        for (_, cache_path), result in zip(missing, results):
+            np.save(cache_path, result)
+
+        return [self.head_predictions(path, cache_path) for path, cache_path in zip(checkpoint_paths, cache_paths)]
+
+    def evaluate(self, checkpoint_paths, weights=None):
+        """
+        Scores every checkpoint and three ensembles of them:
+        'mean': the average prediction of all checkpoints
+        'weighted': the prediction average weighted by `weights`, by default the inverse MPJPE of every checkpoint
+        'per_action_best': the best checkpoint of every action, per metric (an upper bound, not a single model)
+        Returns a dict of name -> {'mpjpe', 'p_mpjpe'} with the single checkpoints under their paths.
+        """
+        index = self.trainer.get_eval_index(self.datareader)
+        device = self.trainer.device
+        predictions = self.predictions(checkpoint_paths)
+        metrics = [evaluate_h36m(prediction, device=device, index=index) for prediction in predictions]
+
+        results = {path: {'mpjpe': m['mpjpe'], 'p_mpjpe': m['p_mpjpe']} for path, m in zip(checkpoint_paths, metrics)}
+        ensemble = evaluate_h36m(np.mean(predictions, axis=0), device=device, index=index)
+        results['mean'] = {'mpjpe': ensemble['mpjpe'], 'p_mpjpe': ensemble['p_mpjpe']}
+
+        if weights is None:
+            weights = [1 / m['mpjpe'] for m in metrics]
+        weights = np.asarray(weights, dtype=np.float64) / np.sum(weights)
+        weighted = sum(weight * prediction for weight, prediction in zip(weights, predictions))
+        ensemble = evaluate_h36m(weighted, device=device, index=index)
+        results['weighted'] = {'mpjpe': ensemble['mpjpe'], 'p_mpjpe': ensemble['p_mpjpe']}
+
+        results['per_action_best'] = {
+            'mpjpe': np.mean(np.min([m['action_mpjpe'] for m in metrics], axis=0)),
+            'p_mpjpe': np.mean(np.min([m['action_p_mpjpe'] for m in metrics], axis=0)),
+        }
+        return results
+
+
+def print_ensemble_results(results):
+    print(f"{'':>40}{'MPJPE':>10}{'P-MPJPE':>10}")
+    for name, values in results.items():
+        label = os.path.basename(name)
+        print(f"{label:>40}{values['mpjpe']:>10.2f}{values['p_mpjpe']:>10.2f}")
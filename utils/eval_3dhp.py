@@ -0,0 +1,120 @@
+import numpy as np
+
+from utils.distributed import gather_object, get_world_size
+
+
+def test_sequence_names(dataset):
+    """Sequence name (TS1 ... TS6) of every item of a Fusion test set, in dataset order."""
+    return [np.asarray(pair[0]).item() for pair in dataset.generator.pairs]
+
+
+class SequenceResults(object):
+    """
+    Preallocated result buffers of the MPI-INF-3DHP test set, sized from the Fusion test dataset.
+    Every test item is the center frame of one window, so each sequence gets one slot per item, in dataset order.
+    Batches write into their slots instead of growing arrays with np.concatenate.
+
+    dataset: Fusion test dataset
+    indices: dataset indices in the order the (non-shuffling) test loader yields them, i.e. its sampler
+    inference: dict mapping every sequence to its absolute predictions (3, J, 1, n_frames), the layout
+               written to the .mat files by save_data_inference
+    errors: (n_items, J) per-joint error of every item
+    """
+    def __init__(self, dataset, indices, n_joints=17):
+        seq_names = test_sequence_names(dataset)
+        self.seq_names = np.array(seq_names)
+        self.slots = np.zeros(len(seq_names), dtype=np.int64)
+        counts = {}
+        for item, seq_name in enumerate(seq_names):
+            self.slots[item] = counts.get(seq_name, 0)
+            counts[seq_name] = self.slots[item] + 1
+
+        self.inference = {seq_name: np.zeros((3, n_joints, 1, count), dtype=np.float32)
+                          for seq_name, count in counts.items()}
+        self.errors = np.zeros((len(seq_names), n_joints), dtype=np.float32)
+        self.indices = np.fromiter(indices, dtype=np.int64)
+        self.position = 0
+
+    def add(self, seq, errors, inference):
+        """
+        Writes the results of the next batch of the test loader.
+        seq: sequence name of every item of the batch
+        errors: (N, J) per-joint errors
+        inference: (N, J, 3) absolute predictions
+        """
+        items = self.indices[self.position:self.position + len(seq)]
+        self.position += len(seq)
+        names = self.seq_names[items]
+        assert list(names) == list(seq), "The test loader does not follow the order of the dataset"
+
+        self.errors[items] = errors
+        for seq_name in np.unique(names):
+            mask = names == seq_name
+            self.inference[seq_name][:, :, 0, self.slots[items[mask]]] = inference[mask].transpose(2, 1, 0)
+
+    def gather(self):
+        """
+        Merges the results of all ranks on the main process. Every rank fills disjoint slots, so the buffers
+        are summed. The other ranks keep only their own shard.
+        """
+        if get_world_size() == 1:
+            return
+        shards = gather_object((self.errors, self.inference))
+        if shards is None:
+            return
+        self.errors = sum(shard[0] for shard in shards)
+        self.inference = {seq_name: sum(shard[1][seq_name] for shard in shards) for seq_name in self.inference}
+
+
+AUC_THRESHOLDS = np.linspace(0, 150, num=151)
+PCK_THRESHOLD = 150
+OCCLUSION_SEQUENCE = 'TS6'
+
+
+def pck_auc(errors, thresholds=AUC_THRESHOLDS, pck_threshold=PCK_THRESHOLD):
+    """
+    PCK and AUC of per-joint errors from a single sort: the fraction of errors below every threshold is
+    read with one searchsorted call instead of one pass over the errors per threshold.
+    Returns PCK (%, errors < pck_threshold) and the area under the PCK curve over thresholds, normalized to [0, 1].
+    """
+    errors = np.sort(errors, axis=None)
+    tpr = np.searchsorted(errors, thresholds, side='right') / len(errors)  # errors <= threshold
+    area_under_curve = np.sum((tpr[1:] + tpr[:-1]) * np.diff(thresholds)) / 2  # Trapezoidal rule
+    pck = np.searchsorted(errors, pck_threshold, side='left') / len(errors) * 100
+    return pck, area_under_curve / (thresholds[-1] - thresholds[0])
+
+
+def evaluate_3dhp(results):
+    """
+    results: SequenceResults of the whole test set
+    Returns a dict mapping 'all' and every test sequence (TS1 ... TS6) to its MPJPE, PCK and AUC.
+    """
+    metrics = {}
+    groups = [('all', results.errors)]
+    groups += [(seq_name, results.errors[results.seq_names == seq_name]) for seq_name in sorted(results.inference)]
+    for name, errors in groups:
+        pck, area_under_curve = pck_auc(errors)
+        metrics[name] = {'mpjpe': np.mean(errors, dtype=np.float64), 'pck': pck, 'auc': area_under_curve}
+    return metrics
+
+
+def print_3dhp_metrics(metrics):
+    print(f"{'':>8}{'MPJPE':>10}{'PCK':>10}{'AUC':>10}")
+    for name, values in metrics.items():
+        label = f'{name}*' if name == OCCLUSION_SEQUENCE else name
+        print(f"{label:>8}{values['mpjpe']:>10.2f}{values['pck']:>10.2f}{values['auc']:>10.4f}")
+    print('* occlusion sequence')
+
+
+def metrics_log(metrics, suffix=''):
+    """Flattens the result of evaluate_3dhp into wandb keys."""
+    values = {
+        'eval/mpjpe': metrics['all']['mpjpe'],
+        'eval/pck': metrics['all']['pck'],
+        'eval/auc': metrics['all']['auc'],
+    }
+    for name, sequence_metrics in metrics.items():
+        if name != 'all':
+            for metric, value in sequence_metrics.items():
+                values[f'eval_sequences/{name}_{metric}'] = value
+    return {key + suffix: value for key, value in values.items()}
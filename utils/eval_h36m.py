@@ -0,0 +1,232 @@
+import os
+
+import numpy as np
+import torch
+
+from utils.mmap_data import categorical_codes
+
+H36M_BLOCK_LIST = ['s_09_act_05_subact_02',
+                   's_09_act_10_subact_02',
+                   's_09_act_13_subact_01']
+
+
+def last_occurrence_mask(frame_clips):
+    """
+    Marks, for every clip, the last position at which each frame index appears.
+    Clips produced by split_clips index frames in non-decreasing order, so a frame is repeated only
+    at consecutive positions (resampled clips of short sequences). Scattering only the marked positions
+    reproduces the `array[frame_list] += values` semantics of the original per-clip loop.
+    """
+    keep = np.ones(frame_clips.shape, dtype=bool)
+    keep[:, :-1] = frame_clips[:, 1:] != frame_clips[:, :-1]
+    return keep
+
+
+def scatter_frames(values, frame_clips, keep, num_frames):
+    """Sums per-clip values (n_clips, T[, J]) into per-frame accumulators of length num_frames."""
+    frame_ids = frame_clips[keep]
+    values = values[keep]
+    if values.ndim == 1:
+        return np.bincount(frame_ids, weights=values, minlength=num_frames)
+    return np.stack([np.bincount(frame_ids, weights=values[:, j], minlength=num_frames)
+                     for j in range(values.shape[1])], axis=1)
+
+
+def grouped_mean(values, group_ids, n_groups):
+    """Mean of values (n[, J]) over each integer group id in [0, n_groups)."""
+    counts = np.bincount(group_ids, minlength=n_groups)
+    if values.ndim == 1:
+        return np.bincount(group_ids, weights=values, minlength=n_groups) / counts
+    sums = np.stack([np.bincount(group_ids, weights=values[:, j], minlength=n_groups)
+                     for j in range(values.shape[1])], axis=1)
+    return sums / counts[:, None]
+
+
+def batch_p_mpjpe(predicted, target):
+    """
+    Pose error after rigid alignment (scale, rotation, and translation) of every frame at once,
+    i.e. Protocol #2 solved with a single batched SVD.
+    predicted, target: (..., J, 3) numpy arrays or torch tensors (CPU or GPU)
+    Returns per-frame errors of shape (...), as the same type as the input.
+    """
+    is_numpy = isinstance(predicted, np.ndarray)
+    if is_numpy:
+        predicted, target = torch.from_numpy(predicted), torch.from_numpy(target)
+    batch_shape = predicted.shape[:-2]
+    predicted = predicted.reshape(-1, *predicted.shape[-2:]).double()
+    target = target.reshape(-1, *target.shape[-2:]).double()
+
+    muX = target.mean(dim=1, keepdim=True)
+    muY = predicted.mean(dim=1, keepdim=True)
+    X0 = target - muX
+    Y0 = predicted - muY
+    normX = torch.sqrt(torch.sum(X0 ** 2, dim=(1, 2), keepdim=True))
+    normY = torch.sqrt(torch.sum(Y0 ** 2, dim=(1, 2), keepdim=True))
+    X0 = X0 / normX
+    Y0 = Y0 / normY
+
+    H = torch.matmul(X0.transpose(1, 2), Y0)
+    U, s, Vt = torch.linalg.svd(H)
+    V = Vt.transpose(1, 2)
+    R = torch.matmul(V, U.transpose(1, 2))
+
+    # Avoid improper rotations (reflections), i.e. rotations with det(R) = -1
+    sign = torch.ones_like(s)
+    sign[:, -1] = torch.sign(torch.linalg.det(R))
+    V = V * sign[:, None, :]
+    s = s * sign
+    R = torch.matmul(V, U.transpose(1, 2))
+
+    tr = torch.sum(s, dim=1, keepdim=True)[:, :, None]
+    a = tr * normX / normY  # Scale
+    t = muX - a * torch.matmul(muY, R)  # Translation
+    predicted_aligned = a * torch.matmul(predicted, R) + t
+
+    errors = torch.mean(torch.norm(predicted_aligned - target, dim=-1), dim=-1).reshape(batch_shape)
+    return errors.numpy() if is_numpy else errors
+
+
+def clip_errors(pred, gt, device='cpu'):
+    """
+    Root-relative errors of all clips at once.
+    pred: (n_clips, T, J, 3) in mm
+    gt: root-relative ground truth (n_clips, T, J, 3) in mm
+    device: where the batched Procrustes alignment is solved
+    Returns per-frame MPJPE (n_clips, T), per-joint error (n_clips, T, J),
+    P-MPJPE (n_clips, T) and acceleration error (n_clips, T-2).
+    """
+    pred = pred - pred[:, :, 0:1, :]
+
+    jpe = np.linalg.norm(pred - gt, axis=-1)
+    mpjpe = np.mean(jpe, axis=-1)
+
+    accel_gt = gt[:, :-2] - 2 * gt[:, 1:-1] + gt[:, 2:]
+    accel_pred = pred[:, :-2] - 2 * pred[:, 1:-1] + pred[:, 2:]
+    acc_err = np.mean(np.linalg.norm(accel_pred - accel_gt, axis=-1), axis=-1)
+
+    p_mpjpe = batch_p_mpjpe(torch.from_numpy(pred).to(device), torch.from_numpy(gt).to(device)).cpu().numpy()
+    return mpjpe, jpe, p_mpjpe, acc_err
+
+
+class EvalIndex(object):
+    """
+    Everything evaluate_h36m needs from the H36M test split, built once per run: the clip to frame map of the
+    evaluated clips, their 2.5D factors and root-relative ground truth, integer action ids and the block list mask.
+    Evaluating a set of predictions is then pure array math on these arrays.
+
+    valid_clips: (n_clips,) False for clips of sequences in H36M_BLOCK_LIST
+    frame_clips: (n_valid, T) test frame of every position of every evaluated clip
+    factors: (n_valid, T) 2.5D factor of every position
+    gt: (n_valid, T, J, 3) root-relative ground truth in mm
+    action_ids: (num_test_frames,) index into action_names of every test frame
+    action_names: (n_actions,) sorted action names
+    """
+    def __init__(self, valid_clips, frame_clips, factors, gt, action_ids, action_names):
+        self.valid_clips = valid_clips
+        self.frame_clips = frame_clips
+        self.factors = factors
+        self.gt = gt
+        self.action_ids = action_ids
+        self.action_names = action_names
+        self.num_test_frames = len(action_ids)
+        self.keep = last_occurrence_mask(frame_clips)
+        self.keep_acc = last_occurrence_mask(frame_clips[:, :-2])
+        self.counts = np.bincount(frame_clips[self.keep], minlength=self.num_test_frames)
+
+    @classmethod
+    def from_datareader(cls, datareader, add_velocity=False):
+        _, split_id_test = datareader.get_split_id()
+        frame_clips = np.asarray(split_id_test)
+        test_set = datareader.dt_dataset['test']
+        action_names, action_ids = categorical_codes(test_set['action'])
+        factors = np.array(test_set['2.5d_factor'])
+        gts = np.array(test_set['joints_2.5d_image'])
+        source_names, source_ids = categorical_codes(test_set['source'])
+
+        if add_velocity:
+            frame_clips = frame_clips[:, :-1]
+        blocked = np.isin([source[:-6] for source in source_names], H36M_BLOCK_LIST)
+        valid_clips = ~blocked[source_ids[frame_clips[:, 0]]]
+        frame_clips = frame_clips[valid_clips]
+
+        gt = gts[frame_clips]
+        gt = gt - gt[:, :, 0:1, :]
+        return cls(valid_clips, frame_clips, factors[frame_clips], gt, action_ids, action_names)
+
+    @staticmethod
+    def signature(datareader, add_velocity, dt_path):
+        """Settings the index depends on; a cached index built with other settings is rebuilt."""
+        return np.array([datareader.n_frames, datareader.sample_stride, datareader.data_stride_test,
+                         int(add_velocity), int(os.path.getmtime(dt_path))])
+
+    @classmethod
+    def cache_path(cls, datareader, add_velocity, dt_path):
+        suffix = '_velocity' if add_velocity else ''
+        return f"{os.path.splitext(dt_path)[0]}_eval_index_{datareader.n_frames}{suffix}.npz"
+
+    @classmethod
+    def cached(cls, datareader, add_velocity=False, dt_path=None):
+        """
+        Builds the index, or loads it from a .npz next to dt_path (the dataset pickle) when one was saved
+        with the same settings. Without dt_path the index is only kept in memory.
+        """
+        if dt_path is None:
+            return cls.from_datareader(datareader, add_velocity)
+        path = cls.cache_path(datareader, add_velocity, dt_path)
+        signature = cls.signature(datareader, add_velocity, dt_path)
+        if os.path.exists(path):
+            cached = np.load(path)
+            if np.array_equal(cached['signature'], signature):
+                return cls(cached['valid_clips'], cached['frame_clips'], cached['factors'], cached['gt'],
+                           cached['action_ids'], cached['action_names'])
+        index = cls.from_datareader(datareader, add_velocity)
+        np.savez(path, signature=signature, valid_clips=index.valid_clips, frame_clips=index.frame_clips,
+                 factors=index.factors, gt=index.gt, action_ids=index.action_ids, action_names=index.action_names)
+        return index
+
+
+def evaluate_h36m(results_all, datareader=None, add_velocity=False, device='cpu', index=None):
+    """
+    Vectorized H36M evaluation. Equivalent to the per-clip loop previously found in evaluate().
+    results_all: denormalized predictions (n_clips, T, J, 3), in the order of datareader.get_split_id()[1]
+    index: EvalIndex of the test split; built from datareader and add_velocity when not given
+    device: where P-MPJPE is computed; pass the model device to run the batched SVD on GPU
+    Returns a dict with the overall MPJPE, P-MPJPE, acceleration error, per-joint errors and per-action results.
+    """
+    if index is None:
+        index = EvalIndex.from_datareader(datareader, add_velocity)
+    assert len(results_all) == len(index.valid_clips)
+
+    frame_clips = index.frame_clips
+    pred = results_all[index.valid_clips] * index.factors[:, :, None, None]
+    err1, jpe, err2, acc_err = clip_errors(pred, index.gt, device)
+
+    num_test_frames = index.num_test_frames
+    e1_all = scatter_frames(err1, frame_clips, index.keep, num_test_frames)
+    e2_all = scatter_frames(err2, frame_clips, index.keep, num_test_frames)
+    jpe_all = scatter_frames(jpe, frame_clips, index.keep, num_test_frames)
+    acc_err_all = scatter_frames(acc_err, frame_clips[:, :-2], index.keep_acc, num_test_frames)
+
+    valid_frames = e1_all > 0
+    oc = index.counts[valid_frames]
+    frame_action_ids = index.action_ids[valid_frames]
+    n_actions = len(index.action_names)
+    action_mpjpe = grouped_mean(e1_all[valid_frames] / oc, frame_action_ids, n_actions)
+    action_p_mpjpe = grouped_mean(e2_all[valid_frames] / oc, frame_action_ids, n_actions)
+    action_acceleration = grouped_mean(acc_err_all[valid_frames] / oc, frame_action_ids, n_actions)
+    action_joints = grouped_mean(jpe_all[valid_frames] / oc[:, None], frame_action_ids, n_actions)
+
+    joint_errors = np.mean(action_joints, axis=0)
+    e1 = np.mean(action_mpjpe)
+    assert round(e1, 4) == round(np.mean(joint_errors), 4), f"MPJPE {e1:.4f} is not equal to mean of joint errors {np.mean(joint_errors):.4f}"
+
+    return {
+        'mpjpe': e1,
+        'p_mpjpe': np.mean(action_p_mpjpe),
+        'acceleration_error': np.mean(action_acceleration),
+        'joint_errors': joint_errors,
+        'action_names': index.action_names.tolist(),
+        'action_mpjpe': action_mpjpe,
+        'action_p_mpjpe': action_p_mpjpe,
+        'action_acceleration': action_acceleration,
+    }
@@ -0,0 +1,153 @@
+import argparse
+import resource
+from time import perf_counter
+
+import torch
+import torch.multiprocessing as mp
+from torch import nn
+from torch.utils.checkpoint import checkpoint
+
+from utils.learning import load_model
+from utils.tools import get_config
+
+GRAD_CHECKPOINT_MODES = ('none', 'every_n', 'all')
+
+
+def block_lists(model):
+    """The outermost nn.ModuleLists of a model, i.e. its stacks of blocks (e.g. the spatio-temporal layers)."""
+    lists = []
+    for name, module in model.named_modules():
+        if isinstance(module, nn.ModuleList) and not any(name.startswith(parent + '.') for parent, _ in lists):
+            lists.append((name, module))
+    return [module for _, module in lists]
+
+
+def _strip_block_prefix(module, state_dict, prefix, local_metadata):
+    block_prefix = prefix + 'block.'
+    for key in [key for key in state_dict if key.startswith(block_prefix)]:
+        state_dict[prefix + key[len(block_prefix):]] = state_dict.pop(key)
+
+
+def _add_block_prefix(state_dict, prefix, local_metadata, strict, missing_keys, unexpected_keys, error_msgs):
+    block_prefix = prefix + 'block.'
+    for key in [key for key in state_dict if key.startswith(prefix) and not key.startswith(block_prefix)]:
+        state_dict[block_prefix + key[len(prefix):]] = state_dict.pop(key)
+
+
+class CheckpointedBlock(nn.Module):
+    """
+    Runs `block` under activation checkpointing (non-reentrant) when training with grad enabled, and plainly
+    otherwise. Being a module rather than a patched forward, DataParallel replicas checkpoint their own copy.
+    State dict keys are those of the bare block, so checkpoints load with and without the wrapper; attributes
+    the model reads from its blocks are forwarded to the block.
+    """
+    def __init__(self, block):
+        super().__init__()
+        self.block = block
+        self._register_state_dict_hook(_strip_block_prefix)
+        self._register_load_state_dict_pre_hook(_add_block_prefix)
+
+    def __getattr__(self, name):
+        try:
+            return super().__getattr__(name)
+        except AttributeError:
+            if name == 'block':  # Not set yet, e.g. while copying
+                raise
+            return getattr(self.block, name)
+
+    def forward(self, *args, **kwargs):
+        if self.training and torch.is_grad_enabled():
+            return checkpoint(self.block, *args, use_reentrant=False, **kwargs)
+        return self.block(*args, **kwargs)
+
+
+def apply_grad_checkpoint(model, mode='none', every_n=2):
+    """
+    Activation checkpointing of the blocks of the outermost nn.ModuleLists of a model built by load_model:
+    their activations are not stored in the forward pass but recomputed in the backward pass.
+    The selected blocks are replaced by CheckpointedBlock wrappers, which keep the state dict layout.
+    mode: 'none', 'every_n' (every every_n-th block of each stack, starting with the first) or 'all'
+    Evaluation and no_grad forward passes are unaffected. Returns the number of checkpointed blocks.
+    """
+    assert mode in GRAD_CHECKPOINT_MODES, f"grad_checkpoint must be one of {GRAD_CHECKPOINT_MODES}, got {mode}"
+    if mode == 'none':
+        return 0
+    n_blocks = 0
+    for blocks in block_lists(model):
+        for idx, block in enumerate(blocks):
+            if mode == 'all' or idx % every_n == 0:
+                blocks[idx] = CheckpointedBlock(block)
+                n_blocks += 1
+    return n_blocks
+
+
+def grad_checkpoint_from_args(model, args):
+    """Applies the grad_checkpoint / grad_checkpoint_every config options."""
+    n_blocks = apply_grad_checkpoint(model, args.get('grad_checkpoint', 'none'), args.get('grad_checkpoint_every', 2))
+    if n_blocks > 0:
+        print(f"[INFO] Activation checkpointing of {n_blocks} blocks")
+    return model
+
+
+def benchmark(args, mode, every_n, batch_size, device, steps=5):
+    """
+    Peak memory (MB) and mean training step time (ms) of one grad_checkpoint mode. Peak memory is the allocated
+    CUDA memory on GPU and the peak resident memory of the process on CPU, so run every mode in a fresh process.
+    """
+    model = load_model(args)
+    apply_grad_checkpoint(model, mode, every_n)
+    model.to(device).train()
+    optimizer = torch.optim.AdamW(model.parameters(), lr=1e-4)
+    x = torch.randn(batch_size, args.n_frames, args.num_joints, args.dim_in, device=device)
+
+    def step():
+        optimizer.zero_grad()
+        output = model(x)
+        output = output[0] if isinstance(output, (tuple, list)) else output
+        output.float().square().mean().backward()
+        optimizer.step()
+
+    on_cuda = torch.device(device).type == 'cuda'
+    step()  # Warm-up
+    if on_cuda:
+        torch.cuda.synchronize()
+        torch.cuda.reset_peak_memory_stats()
+    start = perf_counter()
+    for _ in range(steps):
+        step()
+    if on_cuda:
+        torch.cuda.synchronize()
+    step_time = (perf_counter() - start) / steps * 1000
+    if on_cuda:
+        peak_memory = torch.cuda.max_memory_allocated() / 2 ** 20
+    else:
+        peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10  # KB on Linux
+    return peak_memory, step_time
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Peak memory vs step time of the grad_checkpoint modes')
+    parser.add_argument("--config", type=str, default="configs/h36m/GLC.yaml", help="Path to the config file.")
+    parser.add_argument('--batch-size', type=int, default=None, help='batch size, from the config by default')
+    parser.add_argument('--every-n', type=int, default=2)
+    parser.add_argument('--steps', type=int, default=5)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_args()
+    args = get_config(opts.config)
+    batch_size = opts.batch_size or args.batch_size
+    memory = 'peak MB' if torch.device(opts.device).type == 'cuda' else 'peak RSS MB'
+    print(f"{'grad_checkpoint':>16}{memory:>12}{'step ms':>12}")
+    for mode in GRAD_CHECKPOINT_MODES:
+        with mp.get_context('spawn').Pool(1) as pool:  # A fresh process per mode, for its own peak memory
+            peak_memory, step_time = pool.apply(benchmark, (args, mode, opts.every_n, batch_size, opts.device,
+                                                            opts.steps))
+        label = f'every_{opts.every_n}' if mode == 'every_n' else mode
+        print(f"{label:>16}{peak_memory:>12.0f}{step_time:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
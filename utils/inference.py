@@ -0,0 +1,55 @@
+import os
+
+import torch
+
+from utils.compile import compile_model
+from utils.data import flip_data
+from utils.distributed import load_model_state_dict
+from utils.learning import load_model
+
+
+def flip_inference(model, x, x_flip=None, left_joints=None, right_joints=None):
+    """
+    Flip test-time augmentation in a single forward pass.
+    The input and its mirror are concatenated along the batch dimension, the model runs once,
+    and the prediction of the mirrored half is flipped back and averaged with the original one.
+    x: network input (N, T, J, C)
+    x_flip: mirrored input if the dataset already provides it (MPI-INF-3DHP), otherwise flip_data(x)
+    left_joints, right_joints: joints swapped when flipping; defaults to the H36M layout of flip_data
+    Returns the averaged prediction (N, T, J, 3), or a tuple of them for models with several output heads.
+    """
+    flip_kwargs = {} if left_joints is None else {'left_joints': left_joints, 'right_joints': right_joints}
+    if x_flip is None:
+        x_flip = flip_data(x, **flip_kwargs)
+    batch_size = x.shape[0]
+
+    outputs = model(torch.cat((x, x_flip), dim=0))
+    multi_head = isinstance(outputs, (tuple, list))
+    if not multi_head:
+        outputs = (outputs,)
+
+    averaged = []
+    for output in outputs:
+        output = output.float()  # Average in fp32 when the forward pass ran under autocast
+        output_flip = flip_data(output[batch_size:], **flip_kwargs)  # Flip back
+        averaged.append((output[:batch_size] + output_flip) / 2)
+    return tuple(averaged) if multi_head else averaged[0]
+
+
+def load_inference_model(args, checkpoint_path, device, model_key='model', strict=True, use_ema=True):
+    """
+    Builds the model of a config, loads the weights of a training checkpoint and puts it on `device` in eval mode,
+    compiled when args.compile is set (see utils.compile.compile_model).
+    strict: passed to load_state_dict; False keeps the weights that match and ignores the rest
+    use_ema: load the EMA weights of checkpoints trained with ema_decay, which are the ones evaluated during training,
+             instead of the training weights under model_key
+    """
+    model = load_model(args)
+    checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+    if use_ema and 'ema' in checkpoint:
+        model_key = 'ema'
+    load_model_state_dict(model, checkpoint[model_key], strict=strict)
+    model = model.to(device).eval()
+    stat = os.stat(checkpoint_path)
+    cache_key = f'{os.path.abspath(checkpoint_path)}|{stat.st_mtime_ns}|{stat.st_size}|{model_key}'
+    return compile_model(model, args, device, cache_key=cache_key)
@@ -0,0 +1,61 @@
+import hashlib
+import json
+import os
+
+import numpy as np
+
+
+def cache_key(image_paths, detector_config):
+    """
+    Content address of the 2D keypoints of an image sequence: a hash of the path, modification time and size of
+    every image together with the detector settings, so editing, adding or removing a frame or changing the
+    detector gives a new key.
+    detector_config: JSON-serializable dict of everything the detections depend on (models, input size, ...)
+    """
+    digest = hashlib.sha256()
+    digest.update(json.dumps(detector_config, sort_keys=True).encode())
+    for path in image_paths:
+        stat = os.stat(path)
+        digest.update(f'{os.path.abspath(path)}\0{stat.st_mtime_ns}\0{stat.st_size}\n'.encode())
+    return digest.hexdigest()
+
+
+class KeypointCache(object):
+    """
+    On-disk cache of the 2D detections/keypoints of image sequences, one compressed .npz per sequence named by
+    its cache_key. Reruns on the same footage, e.g. with another lifting model, skip detection entirely.
+    """
+    def __init__(self, cache_dir='demo/keypoint_cache'):
+        self.cache_dir = cache_dir
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, f'{key}.npz')
+
+    def load(self, image_paths, detector_config):
+        """Returns the cached arrays of the sequence as a dict, or None on a miss."""
+        path = self.path(cache_key(image_paths, detector_config))
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as cached:
+            return {name: cached[name] for name in cached.files}
+
+    def save(self, image_paths, detector_config, arrays):
+        """arrays: dict of arrays of the sequence, e.g. {'keypoints': (T, J, 2), 'scores': (T, J)}"""
+        os.makedirs(self.cache_dir, exist_ok=True)
+        path = self.path(cache_key(image_paths, detector_config))
+        tmp_path = os.path.join(self.cache_dir, f'.{os.path.basename(path)}.tmp.npz')
+        np.savez_compressed(tmp_path, **arrays)
+        os.replace(tmp_path, path)
+
+    def get_or_compute(self, image_paths, detector_config, compute):
+        """
+        compute: callable running the 2D detector over image_paths and returning the dict of arrays to cache
+        Returns the arrays, from the cache when the same images were processed with the same detector settings.
+        """
+        arrays = self.load(image_paths, detector_config)
+        if arrays is None:
+            arrays = compute()
+            self.save(image_paths, detector_config, arrays)
+        else:
+            print(f"[INFO] Using cached 2D keypoints of {len(image_paths)} images")
+        return arrays
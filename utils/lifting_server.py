@@ -0,0 +1,159 @@
+import argparse
+import glob
+import json
+import os
+from http.server import HTTPServer, BaseHTTPRequestHandler
+
+import numpy as np
+import torch
+
+from utils.inference import flip_inference, load_inference_model
+from utils.precision import get_precision, autocast, to_float
+from utils.tools import get_config
+
+
+class ImageLifter(object):
+    """
+    2D-to-3D lifting of single images with a model loaded once.
+    An image is lifted as a static window: its keypoints are repeated n_frames times and the pose of the center
+    frame is kept. Up to batch_size images run in one forward pass.
+    """
+    def __init__(self, model, n_frames, device='cpu', precision='fp32', flip=False, batch_size=32):
+        self.model = model
+        self.n_frames = n_frames
+        self.device = device
+        self.precision = precision
+        self.flip = flip
+        self.batch_size = batch_size
+
+    @classmethod
+    def from_config(cls, config, checkpoint_path, device, batch_size=32):
+        args = get_config(config)
+        model = load_inference_model(args, checkpoint_path, device)
+        return cls(model, args.n_frames, device, get_precision(args), args.flip, batch_size)
+
+    @torch.no_grad()
+    def lift(self, keypoints_2d):
+        """keypoints_2d: (N, J, C) normalized 2D keypoints of N images. Returns their (N, J, 3) poses."""
+        poses = []
+        for start in range(0, len(keypoints_2d), self.batch_size):
+            batch = torch.from_numpy(np.asarray(keypoints_2d[start:start + self.batch_size], dtype=np.float32))
+            windows = batch[:, None].expand(-1, self.n_frames, -1, -1).contiguous().to(self.device)
+            with autocast(self.precision, self.device):
+                if self.flip:
+                    outputs = flip_inference(self.model, windows)
+                else:
+                    outputs = to_float(self.model(windows))
+            if isinstance(outputs, tuple):
+                outputs = outputs[0]
+            poses.append(outputs[:, self.n_frames // 2].cpu().numpy())
+        return np.concatenate(poses)
+
+
+def input_files(inputs):
+    """Keypoint .npy files of a list of files and directories."""
+    files = []
+    for path in inputs:
+        files += sorted(glob.glob(os.path.join(path, '*.npy'))) if os.path.isdir(path) else [path]
+    return files
+
+
+def load_keypoints(file):
+    """(J, C) keypoints of an image, saved as (J, C) or (1, J, C)"""
+    keypoints = np.load(file)
+    return keypoints.reshape(-1, *keypoints.shape[-2:])[0]
+
+
+def lift_files(lifter, inputs, output_dir):
+    """
+    Lifts the (J, C) keypoints .npy of every image and writes its (J, 3) pose to output_dir under the same name
+    with a _3d suffix. Returns the written paths.
+    """
+    files = input_files(inputs)
+    if not files:
+        raise ValueError(f"No keypoint .npy files in {inputs}")
+    poses = lifter.lift(np.stack([load_keypoints(file) for file in files]))
+    os.makedirs(output_dir, exist_ok=True)
+    outputs = []
+    for file, pose in zip(files, poses):
+        output = os.path.join(output_dir, os.path.splitext(os.path.basename(file))[0] + '_3d.npy')
+        np.save(output, pose)
+        outputs.append(output)
+    return outputs
+
+
+def resolve_output_dir(output_root, output_dir=None):
+    """
+    Directory under output_root that a request writes to. output_dir is taken relative to output_root;
+    paths that resolve outside of it (absolute paths, '..', symlinks) are rejected.
+    """
+    root = os.path.realpath(output_root)
+    resolved = os.path.realpath(os.path.join(root, output_dir or '.'))
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError(f"output_dir {output_dir} is outside of {output_root}")
+    return resolved
+
+
+def make_handler(lifters, output_root):
+    class LiftingHandler(BaseHTTPRequestHandler):
+        """
+        POST / with a JSON body {"inputs": [files or directories], "output_dir": ..., "model": name}
+        answers {"outputs": [written files]}; model defaults to the first loaded one.
+        output_dir is optional and relative to output_root; poses are never written outside of output_root.
+        """
+        def do_POST(self):
+            try:
+                request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                lifter = lifters[request.get('model', next(iter(lifters)))]
+                output_dir = resolve_output_dir(output_root, request.get('output_dir'))
+                response = {'outputs': lift_files(lifter, request['inputs'], output_dir)}
+                status = 200
+            except Exception as e:
+                response = {'error': repr(e)}
+                status = 400
+            body = json.dumps(response).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+    return LiftingHandler
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Lifts single-image 2D keypoints to 3D with models loaded once')
+    parser.add_argument('--config', type=str, default='configs/h36m/GLC.yaml', help='config of the GLC model')
+    parser.add_argument('--checkpoint', type=str, required=True, help='checkpoint of the GLC model')
+    parser.add_argument('--baseline-config', type=str, default=None,
+                        help='config of the MotionAGFormer baseline, loaded as model "baseline"')
+    parser.add_argument('--baseline-checkpoint', type=str, default=None)
+    parser.add_argument('--inputs', type=str, nargs='*', default=[], help='keypoint .npy files or directories of them')
+    parser.add_argument('--output-dir', type=str, default='demo/output',
+                        help='output directory; when serving, the root that requests write under')
+    parser.add_argument('--usebaseline', action='store_true', help='lift --inputs with the baseline')
+    parser.add_argument('--serve', action='store_true', help='serve lifting requests on localhost instead')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_args()
+    lifters = {'glc': ImageLifter.from_config(opts.config, opts.checkpoint, opts.device, opts.batch_size)}
+    if opts.baseline_config:
+        lifters['baseline'] = ImageLifter.from_config(opts.baseline_config, opts.baseline_checkpoint, opts.device,
+                                                      opts.batch_size)
+
+    if opts.serve:
+        server = HTTPServer(('127.0.0.1', opts.port), make_handler(lifters, opts.output_dir))
+        print(f"[INFO] Serving {list(lifters)} on http://127.0.0.1:{opts.port}, writing under {opts.output_dir}")
+        server.serve_forever()
+    else:
+        outputs = lift_files(lifters['baseline' if opts.usebaseline else 'glc'], opts.inputs, opts.output_dir)
+        print(f"[INFO] Wrote {len(outputs)} poses to {opts.output_dir}")
+
+
+if __name__ == '__main__':
+    main()
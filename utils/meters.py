@@ -0,0 +1,46 @@
+import torch
+
+
+class LossAccumulator(object):
+    """
+    Keeps batch-size weighted running sums of the loss terms on the device they were computed on,
+    so the training loop does not force a device-to-host sync with .item() on every step.
+    flush() copies all sums to the host at once and feeds the AverageMeters in `losses`,
+    which then hold the same averages as if they had been updated every step.
+    sync_interval: if > 0, flush automatically every `sync_interval` steps
+    """
+    def __init__(self, losses, sync_interval=0):
+        self.losses = losses
+        self.sync_interval = sync_interval
+        self.names = None
+        self.sums = None
+        self.count = 0
+        self.steps = 0
+
+    def update(self, values, n):
+        """values: dict mapping loss names to scalar tensors (plain numbers are accepted too)"""
+        names = list(values.keys())
+        if self.sums is not None and names != self.names:
+            self.flush()
+
+        device = next((v.device for v in values.values() if torch.is_tensor(v)), None)
+        stacked = torch.stack([torch.as_tensor(v, device=device).detach().reshape(()).to(torch.float64)
+                               for v in values.values()]) * n
+        if self.sums is None:
+            self.names = names
+            self.sums = stacked
+        else:
+            self.sums += stacked
+        self.count += n
+        self.steps += 1
+
+        if self.sync_interval > 0 and self.steps % self.sync_interval == 0:
+            self.flush()
+
+    def flush(self):
+        if self.sums is None:
+            return
+        for name, total in zip(self.names, self.sums.cpu().tolist()):
+            self.losses[name].update(total / self.count, self.count)
+        self.sums = None
+        self.count = 0
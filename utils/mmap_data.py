@@ -0,0 +1,254 @@
+"""
+Memory-mapped (columnar) layout of the H36M data: a directory per table with one .npy file per field and an
+index.json describing them. String fields (source, action, camera name) are stored as integer ids, their names
+are kept in the index, and they are only decoded where they are read. Arrays are opened with np.load(mmap_mode='r'), so DataLoader workers share the pages
+through the OS page cache instead of each holding an unpickled copy.
+
+Convert once with
+    python -m utils.mmap_data --config configs/h36m/MotionAGFormer-base.yaml
+and set `data_format: mmap` in the config.
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import torch
+from tqdm import tqdm
+
+from data.reader.h36m import DataReaderH36M
+from data.reader.motion_dataset import MotionDataset3D
+from utils.tools import read_pkl, get_config
+
+INDEX_FILE = 'index.json'
+
+
+def mmap_dir(path):
+    """Directory of the memory-mapped copy of a pickle file or of a directory of per-clip pickles."""
+    return os.path.splitext(path.rstrip('/'))[0] + '_mmap'
+
+
+def save_index(directory, fields, categories, length):
+    index = {
+        'length': length,
+        'fields': {name: {'file': f'{name}.npy', 'dtype': values.dtype.str, 'shape': list(values.shape)}
+                   for name, values in fields.items()},
+        'categories': categories,
+    }
+    tmp_path = os.path.join(directory, f'.{INDEX_FILE}.tmp')
+    with open(tmp_path, 'w') as file:
+        json.dump(index, file, indent=1)
+    os.replace(tmp_path, os.path.join(directory, INDEX_FILE))  # The index is written last, marking a complete table
+
+
+def write_table(directory, columns):
+    """Writes a dict of equally long fields as a table; string fields are stored as ids into their sorted names."""
+    os.makedirs(directory, exist_ok=True)
+    fields, categories = {}, {}
+    for name, values in columns.items():
+        values = np.asarray(values)
+        if values.dtype.kind in 'USO':
+            names, values = np.unique(values.astype(str), return_inverse=True)
+            categories[name] = names.tolist()
+            values = values.astype(np.int32)
+        values = np.ascontiguousarray(values)
+        np.save(os.path.join(directory, f'{name}.npy'), values)
+        fields[name] = values
+    lengths = {len(values) for values in fields.values()}
+    assert len(lengths) == 1, f"Fields of {directory} differ in length"
+    save_index(directory, fields, categories, lengths.pop())
+
+
+class CategoricalColumn(object):
+    """
+    String field of an MmapTable, decoded lazily: indexing decodes only the selected entries and slicing returns
+    another lazy column, so per-frame fields like source are never expanded into a string array in every process.
+    np.asarray() decodes the whole column; categorical_codes() gives the names and ids without decoding.
+    """
+    def __init__(self, ids, names):
+        self.ids = ids
+        self.names = names
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, index):
+        ids = self.ids[index]
+        if isinstance(index, slice):
+            return CategoricalColumn(ids, self.names)
+        return self.names[ids]
+
+    def __iter__(self):
+        for idx in range(len(self)):
+            yield self[idx]
+
+    def __array__(self, dtype=None):
+        values = self.names[np.asarray(self.ids)]
+        return values if dtype is None else values.astype(dtype)
+
+
+def categorical_codes(column):
+    """
+    (sorted names, id of every entry) of a string column, read from the encoding of a CategoricalColumn and
+    computed with np.unique for a plain sequence of strings.
+    """
+    if isinstance(column, CategoricalColumn):
+        return column.names, np.asarray(column.ids)
+    return np.unique(np.asarray(column), return_inverse=True)
+
+
+class MmapTable(object):
+    """
+    Read-only view of a table written by write_table. Fields are memory-mapped on first access;
+    string fields are returned as CategoricalColumns, ids(name) gives their raw ids.
+    Pickling (e.g. to spawned DataLoader workers) drops the open mappings, they are reopened on access.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        with open(os.path.join(directory, INDEX_FILE)) as file:
+            self.index = json.load(file)
+        self.columns = {}
+
+    def __len__(self):
+        return self.index['length']
+
+    def __contains__(self, name):
+        return name in self.index['fields']
+
+    def keys(self):
+        return self.index['fields'].keys()
+
+    def ids(self, name):
+        return np.load(os.path.join(self.directory, self.index['fields'][name]['file']), mmap_mode='r')
+
+    def __getitem__(self, name):
+        if name not in self.columns:
+            values = self.ids(name)
+            if name in self.index['categories']:
+                values = CategoricalColumn(values, np.asarray(self.index['categories'][name]))
+            self.columns[name] = values
+        return self.columns[name]
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['columns'] = {}
+        return state
+
+
+def convert_dt_file(dt_path):
+    """Converts a DataReaderH36M pickle (e.g. h36m_sh_conf_cam_source_final.pkl) to one table per split."""
+    dt_dataset = read_pkl(dt_path)
+    for split, columns in dt_dataset.items():
+        write_table(os.path.join(mmap_dir(dt_path), split), columns)
+
+
+def convert_clips(clip_dir):
+    """Stacks the per-clip pickles of a MotionDataset3D split directory into data_input.npy and data_label.npy."""
+    file_list = sorted(os.listdir(clip_dir))
+    out_dir = mmap_dir(clip_dir)
+    os.makedirs(out_dir, exist_ok=True)
+    fields = {}
+    for idx, file_name in enumerate(tqdm(file_list)):
+        motion_file = read_pkl(os.path.join(clip_dir, file_name))
+        for name in ('data_input', 'data_label'):
+            values = np.asarray(motion_file[name], dtype=np.float32)
+            if name not in fields:  # Written in place, the clips are never all held in memory
+                fields[name] = np.lib.format.open_memmap(os.path.join(out_dir, f'{name}.npy'), mode='w+',
+                                                         dtype=np.float32, shape=(len(file_list), *values.shape))
+            fields[name][idx] = values
+    for values in fields.values():
+        values.flush()
+    save_index(out_dir, fields, {}, len(file_list))
+
+
+class MmapDataReaderH36M(DataReaderH36M):
+    """DataReaderH36M reading the memory-mapped copy of dt_file written by convert_dt_file."""
+    def __init__(self, n_frames, sample_stride, data_stride_train, data_stride_test, read_confidence=True,
+                 dt_root='data/motion3d', dt_file='h36m_cpn_cam_source.pkl'):
+        # Same state as DataReaderH36M.__init__, without unpickling dt_file
+        self.gt_trainset = None
+        self.gt_testset = None
+        self.split_id_train = None
+        self.split_id_test = None
+        self.test_hw = None
+        self.dt_dataset = {split: MmapTable(os.path.join(mmap_dir(os.path.join(dt_root, dt_file)), split))
+                           for split in ('train', 'test')}
+        self.n_frames = n_frames
+        self.sample_stride = sample_stride
+        self.data_stride_train = data_stride_train
+        self.data_stride_test = data_stride_test
+        self.read_confidence = read_confidence
+
+
+class MmapMotionDataset3D(MotionDataset3D):
+    """MotionDataset3D reading the clips of every subset from the memory-mapped tables written by convert_clips."""
+    def __init__(self, args, subset_list, data_split):
+        # MotionDataset3D.__init__ lists the per-clip pickles, which these tables replace
+        self.data_root = args.data_root
+        self.subset_list = subset_list
+        self.data_split = data_split
+        self.use_proj_as_2d = args.get('use_proj_as_2d', False)
+        self.tables = [MmapTable(mmap_dir(os.path.join(self.data_root, subset, data_split))) for subset in subset_list]
+        self.offsets = np.cumsum([0] + [len(table) for table in self.tables])
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def __getitem__(self, index):
+        subset = np.searchsorted(self.offsets, index, side='right') - 1
+        table, index = self.tables[subset], index - self.offsets[subset]
+        motion_3d = np.array(table['data_label'][index])  # Copied out of the page cache
+        if self.data_split == 'train':
+            if self.use_proj_as_2d:
+                motion_2d = motion_3d[..., :2]
+            else:
+                motion_2d = np.array(table['data_input'][index])
+        elif self.data_split == 'test':
+            motion_2d = np.array(table['data_input'][index])
+        else:
+            raise ValueError('Data split unknown.')
+        return torch.FloatTensor(motion_2d), torch.FloatTensor(motion_3d)
+
+
+DATA_FORMATS = {
+    'pkl': (DataReaderH36M, MotionDataset3D),
+    'mmap': (MmapDataReaderH36M, MmapMotionDataset3D),
+}
+
+
+def h36m_data_classes(args):
+    """(datareader class, dataset class) of args.data_format"""
+    data_format = args.get('data_format', 'pkl')
+    assert data_format in DATA_FORMATS, f"data_format must be one of {list(DATA_FORMATS)}, got {data_format}"
+    return DATA_FORMATS[data_format]
+
+
+def dt_file_path(args, dt_root='data/motion3d'):
+    """File the test split of dt_file is read from; its modification time invalidates cached evaluation indices."""
+    dt_path = os.path.join(dt_root, args.dt_file)
+    if args.get('data_format', 'pkl') == 'mmap':
+        return os.path.join(mmap_dir(dt_path), 'test', INDEX_FILE)
+    return dt_path
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Converts the H36M data of a config to the memory-mapped layout')
+    parser.add_argument("--config", type=str, default="configs/h36m/MotionAGFormer-base.yaml", help="Path to the config file.")
+    parser.add_argument('--dt-root', type=str, default='data/motion3d', help='directory of dt_file')
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_args()
+    args = get_config(opts.config)
+    print(f"[INFO] Converting {args.dt_file}")
+    convert_dt_file(os.path.join(opts.dt_root, args.dt_file))
+    for subset in args.subset_list:
+        for data_split in ('train', 'test'):
+            print(f"[INFO] Converting {subset}/{data_split}")
+            convert_clips(os.path.join(args.data_root, subset, data_split))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+import contextlib
+
+import torch
+
+PRECISIONS = {
+    'fp32': torch.float32,
+    'bf16': torch.bfloat16,
+    'fp16': torch.float16,
+}
+
+
+def get_precision(args):
+    """Reads the `precision` config option (fp32, bf16 or fp16); configs without it run in fp32."""
+    precision = args.get('precision', 'fp32')
+    assert precision in PRECISIONS, f"precision must be one of {list(PRECISIONS)}, got {precision}"
+    return precision
+
+
+def autocast(precision, device):
+    """
+    Autocast context for the forward pass.
+    fp32 is a no-op. On CPU only bf16 autocast is supported, so fp16 falls back to bf16 there,
+    and torch builds without CPU autocast run in fp32.
+    """
+    device_type = torch.device(device).type
+    if precision == 'fp32' or not hasattr(torch, 'autocast'):
+        return contextlib.nullcontext()
+    dtype = PRECISIONS[precision]
+    if device_type == 'cpu':
+        dtype = torch.bfloat16
+    return torch.autocast(device_type=device_type, dtype=dtype)
+
+
+def make_grad_scaler(precision, device):
+    """Loss scaler for fp16 training on GPU; disabled (a pass-through) for fp32, bf16 and CPU."""
+    enabled = precision == 'fp16' and torch.device(device).type == 'cuda'
+    return torch.cuda.amp.GradScaler(enabled=enabled)
+
+
+def to_float(outputs):
+    """Casts model outputs (a tensor or a tuple of head outputs) back to fp32."""
+    if isinstance(outputs, (tuple, list)):
+        return tuple(output.float() for output in outputs)
+    return outputs.float()
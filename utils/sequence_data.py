@@ -0,0 +1,113 @@
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from utils.data import resample
+from utils.mmap_data import CategoricalColumn
+
+
+def sequence_bounds(sources):
+    """Start and end frame of every run of equal sources, i.e. of every subject/action/camera sequence."""
+    if isinstance(sources, CategoricalColumn):
+        sources = sources.ids  # Compares ids, memory-mapped sources are not decoded
+    sources = np.asarray(sources)
+    changes = np.flatnonzero(sources[1:] != sources[:-1]) + 1
+    return np.r_[0, changes], np.r_[changes, len(sources)]
+
+
+def sequence_windows(sources, n_frames, stride):
+    """
+    Start frame and sequence of every window, following split_clips: windows start every `stride` frames and must
+    fit in their sequence; a sequence shorter than n_frames gets a single window resampled to n_frames, except for
+    the last sequence, which split_clips drops when it is that short.
+    Returns (window_starts, window_sequences, sequence_starts, sequence_ends).
+    """
+    seq_starts, seq_ends = sequence_bounds(sources)
+    window_starts, window_sequences = [], []
+    for seq, (start, end) in enumerate(zip(seq_starts, seq_ends)):
+        if end - start >= n_frames:
+            starts = np.arange(start, end - n_frames + 1, stride)
+        elif seq + 1 < len(seq_starts):
+            starts = np.array([start])
+        else:
+            starts = np.array([], dtype=int)
+        window_starts.append(starts)
+        window_sequences.append(np.full(len(starts), seq))
+    return np.concatenate(window_starts), np.concatenate(window_sequences), seq_starts, seq_ends
+
+
+class SequenceMotionDataset3D(Dataset):
+    """
+    Training set sliced from whole sequences when an item is read, instead of from pre-materialized clips.
+    Every frame is stored once however much the windows overlap, and n_frames and the stride can be changed
+    without regenerating the data.
+
+    data_2d: (n_frames_total, J, C) normalized 2D input of the split, as returned by DataReaderH36M.read_2d
+    data_3d: (n_frames_total, J, 3) normalized 3D labels, as returned by DataReaderH36M.read_3d
+    sources: sequence name of every frame
+    random_offset: shift every window by a random number of frames below `stride`, within its sequence
+    """
+    def __init__(self, args, data_2d, data_3d, sources, n_frames, stride, random_offset=False):
+        self.data_2d = data_2d
+        self.data_3d = data_3d
+        self.n_frames = n_frames
+        self.stride = stride
+        self.random_offset = random_offset
+        self.use_proj_as_2d = args.get('use_proj_as_2d', False)
+        self.window_starts, self.window_sequences, self.seq_starts, self.seq_ends = \
+            sequence_windows(sources, n_frames, stride)
+
+    def __len__(self):
+        return len(self.window_starts)
+
+    def frames(self, index):
+        start = self.window_starts[index]
+        seq = self.window_sequences[index]
+        seq_start, seq_end = self.seq_starts[seq], self.seq_ends[seq]
+        if seq_end - seq_start < self.n_frames:
+            return resample(seq_end - seq_start, self.n_frames) + seq_start
+        if self.random_offset:
+            start = min(start + np.random.randint(self.stride), seq_end - self.n_frames)
+        return slice(start, start + self.n_frames)
+
+    def __getitem__(self, index):
+        frames = self.frames(index)
+        motion_3d = self.data_3d[frames]
+        if self.use_proj_as_2d:
+            motion_2d = motion_3d[..., :2]
+        else:
+            motion_2d = self.data_2d[frames]
+        return torch.FloatTensor(motion_2d), torch.FloatTensor(motion_3d)
+
+
+class ClipMotionDataset3D(Dataset):
+    """Test set of the clips of datareader.get_split_id(), sliced from the per-frame arrays."""
+    def __init__(self, data_2d, data_3d, clips):
+        self.data_2d = data_2d
+        self.data_3d = data_3d
+        self.clips = clips
+
+    def __len__(self):
+        return len(self.clips)
+
+    def __getitem__(self, index):
+        frames = self.clips[index]
+        return torch.FloatTensor(self.data_2d[frames]), torch.FloatTensor(self.data_3d[frames])
+
+
+def sequence_datasets(args, datareader):
+    """
+    Train and test sets sliced from the per-frame data of datareader (args.sequence_dataset).
+    Training windows have args.n_frames frames every args.clip_stride frames (n_frames // 3 by default), shifted
+    randomly with args.random_clip_offset. The test clips are those of datareader.get_split_id(), the clips the
+    H36M evaluation expects.
+    """
+    train_2d, test_2d = datareader.read_2d()
+    train_3d, test_3d = datareader.read_3d()
+    sources = datareader.dt_dataset['train']['source'][::datareader.sample_stride]
+    train_dataset = SequenceMotionDataset3D(args, train_2d, train_3d, sources, n_frames=args.n_frames,
+                                            stride=args.get('clip_stride', args.n_frames // 3),
+                                            random_offset=args.get('random_clip_offset', False))
+    _, split_id_test = datareader.get_split_id()
+    test_dataset = ClipMotionDataset3D(test_2d, test_3d, [np.asarray(frames) for frames in split_id_test])
+    return train_dataset, test_dataset
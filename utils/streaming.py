@@ -0,0 +1,159 @@
+import argparse
+from collections import deque
+from time import perf_counter
+
+import numpy as np
+import torch
+
+from utils.inference import flip_inference, load_inference_model
+from utils.precision import get_precision, autocast, to_float
+from utils.tools import get_config
+
+DEFAULT_STRIDE = 9
+
+
+class StreamingPoseEstimator(object):
+    """
+    Online 3D pose estimation over a sliding temporal window.
+    2D frames are pushed one at a time into a ring buffer of the last n_frames frames. Every `stride` frames the
+    window is queued, and once `batch_size` windows are queued they run through the model in one forward pass.
+    Each window emits the poses of its last `stride` frames, so a forward pass is spent on every `stride` new
+    frames instead of on every frame. Until n_frames frames were pushed, the window is padded with the first one.
+
+    model: loaded model, taking (N, n_frames, J, C) normalized 2D keypoints (screen coordinates in [-1, 1] and
+           confidence) and returning (N, n_frames, J, 3), or a tuple of them of which the first head is used
+    stride: frames emitted per window, trading latency for compute. The model runs once per `stride` frames
+            instead of once per frame, but a frame waits for up to stride - 1 later frames before its window runs
+            (0.27 s at 30 fps for the default of 9). Emitted frames see at most stride - 1 future frames, so a
+            larger stride does not cost accuracy. 1 emits every frame as soon as it is pushed (with batch_size 1).
+    batch_size: windows per forward pass; more windows amortize the pass over more frames at the cost of latency
+    flip: flip test-time augmentation
+    """
+    def __init__(self, model, n_frames=243, stride=DEFAULT_STRIDE, batch_size=1, device='cpu', precision='fp32',
+                 flip=False):
+        assert 1 <= stride <= n_frames, f"stride must be in [1, {n_frames}], got {stride}"
+        self.model = model.eval()
+        self.n_frames = n_frames
+        self.stride = stride
+        self.batch_size = batch_size
+        self.device = device
+        self.precision = precision
+        self.flip = flip
+        self.reset()
+
+    def reset(self):
+        self.buffer = None
+        self.n_pushed = 0
+        self.pending = []  # (window, index of its first emitted frame, number of emitted frames)
+        self.push_times = {}
+        self.latencies = []
+        self.results = deque()
+
+    def push(self, keypoints_2d):
+        """
+        keypoints_2d: (J, C) normalized 2D keypoints of the next frame
+        Returns the (J, 3) pose of the most recent frame emitted by this call, or None if no window ran.
+        All emitted poses are appended to self.results as (frame index, pose).
+        """
+        keypoints_2d = np.asarray(keypoints_2d, dtype=np.float32)
+        if self.buffer is None:
+            self.buffer = np.repeat(keypoints_2d[None], self.n_frames, axis=0)
+        self.buffer[self.n_pushed % self.n_frames] = keypoints_2d
+        self.push_times[self.n_pushed] = perf_counter()
+        self.n_pushed += 1
+
+        if self.n_pushed % self.stride == 0:
+            self.pending.append((self.window(), self.n_pushed - self.stride, self.stride))
+        if len(self.pending) >= self.batch_size:
+            return self.run()
+        return None
+
+    def window(self):
+        """The last n_frames frames in temporal order; the first frame fills the positions before it."""
+        order = (self.n_pushed + np.arange(self.n_frames)) % self.n_frames
+        return self.buffer[order]
+
+    def flush(self):
+        """Runs the queued windows and a last window for the frames pushed since the last full stride."""
+        remainder = self.n_pushed % self.stride
+        if remainder > 0:
+            self.pending.append((self.window(), self.n_pushed - remainder, remainder))
+        return self.run() if self.pending else None
+
+    @torch.no_grad()
+    def run(self):
+        windows = torch.from_numpy(np.stack([window for window, _, _ in self.pending])).to(self.device)
+        with autocast(self.precision, self.device):
+            if self.flip:
+                outputs = flip_inference(self.model, windows)
+            else:
+                outputs = to_float(self.model(windows))
+        if isinstance(outputs, tuple):
+            outputs = outputs[0]
+        outputs = outputs.cpu().numpy()
+        done = perf_counter()
+
+        pose = None
+        for output, (_, first, count) in zip(outputs, self.pending):
+            for frame, pose in zip(range(first, first + count), output[-count:]):
+                self.results.append((frame, pose))
+                self.latencies.append(done - self.push_times.pop(frame))
+        self.pending = []
+        return pose
+
+    def latency_report(self):
+        """Push-to-emit latency of every emitted frame, in ms."""
+        latencies = np.array(self.latencies) * 1000
+        return {
+            'frames': len(latencies),
+            'mean': latencies.mean(),
+            'p50': np.percentile(latencies, 50),
+            'p95': np.percentile(latencies, 95),
+            'max': latencies.max(),
+        }
+
+    def replay(self, keypoints_2d):
+        """
+        Streams a whole sequence, e.g. a keypoint .npy recorded from the demo, frame by frame.
+        keypoints_2d: (T, J, C) array or path of a .npy file
+        Returns the (T, J, 3) poses in frame order.
+        """
+        if isinstance(keypoints_2d, str):
+            keypoints_2d = np.load(keypoints_2d)
+        self.reset()
+        for frame in keypoints_2d:
+            self.push(frame)
+        self.flush()
+        return np.stack([pose for _, pose in sorted(self.results, key=lambda result: result[0])])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Replays a 2D keypoint sequence through the streaming estimator')
+    parser.add_argument("--config", type=str, default="configs/h36m/GLC.yaml", help="Path to the config file.")
+    parser.add_argument('--checkpoint', type=str, required=True, help='checkpoint file')
+    parser.add_argument('--keypoints', type=str, required=True, help='(T, J, C) normalized 2D keypoints .npy')
+    parser.add_argument('--output', type=str, default=None, help='.npy file for the (T, J, 3) poses')
+    parser.add_argument('--stride', type=int, default=DEFAULT_STRIDE,
+                        help='frames emitted per forward pass; 1 minimizes latency at the cost of a pass per frame')
+    parser.add_argument('--batch-size', type=int, default=1)
+    parser.add_argument('--device', type=str, default='cuda' if torch.cuda.is_available() else 'cpu')
+    return parser.parse_args()
+
+
+def main():
+    opts = parse_args()
+    args = get_config(opts.config)
+    model = load_inference_model(args, opts.checkpoint, opts.device)
+    estimator = StreamingPoseEstimator(model, n_frames=args.n_frames, stride=opts.stride,
+                                       batch_size=opts.batch_size, device=opts.device,
+                                       precision=get_precision(args), flip=args.flip)
+    poses = estimator.replay(opts.keypoints)
+    report = estimator.latency_report()
+    print(f"[INFO] {report['frames']} frames, latency mean {report['mean']:.2f} ms, p50 {report['p50']:.2f} ms, "
+          f"p95 {report['p95']:.2f} ms, max {report['max']:.2f} ms")
+    if opts.output:
+        np.save(opts.output, poses)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,599 @@
+import contextlib
+import os
+import uuid
+from collections import namedtuple
+from time import time
+
+import numpy as np
+import torch
+from torch import optim
+from torch.nn.parallel import DistributedDataParallel
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from data.const import H36M_JOINT_TO_LABEL, H36M_UPPER_BODY_JOINTS, H36M_LOWER_BODY_JOINTS, H36M_1_DF, H36M_2_DF, \
+    H36M_3_DF
+from loss.bundle import PoseLossBundle
+from utils.checkpoint import CheckpointManager
+from utils.augment import BatchAugmenter
+from utils.compile import compile_model
+from utils.ema import ModelEMA
+from utils.grad_checkpoint import grad_checkpoint_from_args
+from utils.distributed import init_distributed_mode, is_main_process, wrap_model, eval_model, make_sampler, \
+    gather_predictions, broadcast_object, model_state_dict, load_model_state_dict
+from utils.eval_h36m import evaluate_h36m, EvalIndex
+from utils.inference import flip_inference
+from utils.learning import load_model, AverageMeter, decay_lr_exponentially
+from utils.meters import LossAccumulator
+from utils.mmap_data import h36m_data_classes, dt_file_path
+from utils.sequence_data import sequence_datasets
+from utils.precision import get_precision, autocast, make_grad_scaler, to_float
+from utils.tools import print_args, create_directory_if_not_exists, count_param_numbers
+
+# Output-head contracts: the suffix of every head the model returns, in order
+HEADS = {
+    'single': ('',),  # model(x) -> pred
+    'mutual': ('', '_mo'),  # model(x) -> (pred, pred_mo)
+}
+# Optional extra head of multi-head models: the average of the predictions of all heads
+AVERAGE_HEAD = '_avg'
+
+# Loss sets: keyword arguments of PoseLossBundle.from_args
+LOSS_SETS = {
+    'pose': {},
+    'bone_length': {'bone_length': True},
+    'mutual': {'bone_length': True, 'mutual': True},
+}
+
+# File names use {head} (the head suffix), snapshots also {epoch}, {mpjpe} and {p_mpjpe}.
+# Snapshots of the snapshot_top_k best epochs of every head are kept, ranked by args.checkpoint_metric;
+# args.checkpoint_top_k overrides the number.
+# decayed_lr: the lr is decayed before the checkpoints of an epoch are written, so they resume with the lr of the
+# next epoch (train_new.py); otherwise it is decayed after them and resuming applies the decay.
+CheckpointFormat = namedtuple('CheckpointFormat', ['latest', 'best', 'snapshot', 'snapshot_top_k',
+                                                   'model_key', 'metric_key', 'decayed_lr'], defaults=(False,))
+H36M_CHECKPOINTS = CheckpointFormat(latest='latest_epoch{head}.pth.tr',
+                                    best='best_epoch{head}.pth.tr',
+                                    snapshot='latest_epoch{epoch}{head}_{mpjpe}_{p_mpjpe}.pth.tr',
+                                    snapshot_top_k=0,
+                                    model_key='model',
+                                    metric_key='min_mpjpe')
+
+TRAIN_LOG_KEYS = {
+    'angle_velocity': 'train/angle_velocity',
+    'bone_length': 'train/bone_length',
+    'online_mutual': 'train/online_mutual',
+    'total': 'train/total',
+}
+
+
+def head_name(suffix):
+    return suffix.lstrip('_') or 'org'
+
+
+def new_run_id():
+    """wandb run id, also stored in the checkpoints of runs that do not log to wandb"""
+    try:
+        import wandb
+        return wandb.util.generate_id()
+    except ImportError:
+        return uuid.uuid4().hex[:8]
+
+
+class NullLogger(object):
+    def log(self, values, step):
+        pass
+
+    def finish(self, files):
+        pass
+
+
+class WandbLogger(object):
+    def __init__(self, args, opts, run_id, resume):
+        import pkg_resources
+        import wandb
+        self.wandb = wandb
+        if resume:
+            wandb.init(id=run_id,
+                       project='MotionMetaFormer',
+                       resume="must",
+                       settings=wandb.Settings(start_method='fork'))
+        else:
+            wandb.init(id=run_id,
+                       name=opts.wandb_name,
+                       project='MotionMetaFormer',
+                       settings=wandb.Settings(start_method='fork'))
+            wandb.config.update({"run_id": run_id})
+            wandb.config.update(args)
+            installed_packages = {d.project_name: d.version for d in pkg_resources.working_set}
+            wandb.config.update({'installed_packages': installed_packages})
+
+    def log(self, values, step):
+        self.wandb.log(values, step=step)
+
+    def finish(self, files):
+        artifact = self.wandb.Artifact('model', type='model')
+        for file in files:
+            artifact.add_file(file)
+        self.wandb.log_artifact(artifact)
+
+
+class TensorboardLogger(object):
+    # Tags used by the tensorboard runs of train_new.py; other values are logged under their own key
+    TAGS = {
+        'eval/mpjpe': 'Error P1',
+        'eval/p-mpjpe': 'Error P2',
+        'train/loss_3d_pose': 'loss_3d_pos',
+        'train/loss_3d_scale': 'loss_3d_scale',
+        'train/loss_3d_velocity': 'loss_3d_velocity',
+        'train/loss_lv': 'loss_lv',
+        'train/loss_lg': 'loss_lg',
+        'train/loss_angle': 'loss_a',
+        'train/angle_velocity': 'loss_av',
+        'train/total': 'loss_total',
+    }
+
+    def __init__(self, log_dir):
+        import tensorboardX
+        self.writer = tensorboardX.SummaryWriter(log_dir)
+
+    def log(self, values, step):
+        for key, value in values.items():
+            self.writer.add_scalar(self.TAGS.get(key, key), value, step)
+
+    def finish(self, files):
+        self.writer.close()
+
+
+def make_logger(kind, args=None, opts=None, run_id=None, resume=False, log_dir=None):
+    """kind: 'wandb', 'tensorboard' or 'none'. Only the main process logs."""
+    if kind == 'none' or not is_main_process():
+        return NullLogger()
+    if kind == 'wandb':
+        return WandbLogger(args, opts, run_id, resume)
+    if kind == 'tensorboard':
+        return TensorboardLogger(log_dir)
+    raise ValueError(f"Unknown logger {kind}")
+
+
+def eval_log(metrics, min_mpjpe, suffix=''):
+    joints_error = metrics['joint_errors']
+    values = {
+        'eval/mpjpe': metrics['mpjpe'],
+        'eval/acceleration_error': metrics['acceleration_error'],
+        'eval/min_mpjpe': min_mpjpe,
+        'eval/p-mpjpe': metrics['p_mpjpe'],
+        'eval_additional/upper_body_error': np.mean(joints_error[H36M_UPPER_BODY_JOINTS]),
+        'eval_additional/lower_body_error': np.mean(joints_error[H36M_LOWER_BODY_JOINTS]),
+        'eval_additional/1_DF_error': np.mean(joints_error[H36M_1_DF]),
+        'eval_additional/2_DF_error': np.mean(joints_error[H36M_2_DF]),
+        'eval_additional/3_DF_error': np.mean(joints_error[H36M_3_DF]),
+    }
+    for joint_idx in range(len(joints_error)):
+        values[f"eval_joints/{H36M_JOINT_TO_LABEL[joint_idx]}"] = joints_error[joint_idx]
+    return {key + suffix: value for key, value in values.items()}
+
+
+def make_datareader(args):
+    """H36M data reader used for the evaluation."""
+    DataReader, _ = h36m_data_classes(args)
+    return DataReader(n_frames=args.n_frames, sample_stride=1,
+                      data_stride_train=args.n_frames // 3, data_stride_test=args.n_frames,
+                      dt_root='data/motion3d', dt_file=args.dt_file)
+
+
+def make_datasets(args, datareader):
+    """Train and test sets of args.subset_list, or sliced from the sequences of datareader with args.sequence_dataset."""
+    if args.get('sequence_dataset', False):
+        return sequence_datasets(args, datareader)
+    _, MotionDataset = h36m_data_classes(args)
+    train_dataset = MotionDataset(args, args.subset_list, 'train')
+    train_dataset.flip = False  # Flipping is done on the training device, see BatchAugmenter
+    return train_dataset, MotionDataset(args, args.subset_list, 'test')
+
+
+def make_loaders(args, train_dataset, test_dataset, num_workers, prefetch_factor):
+    """Returns the train loader, the test loader and the train sampler (None outside of distributed mode)."""
+    common_loader_params = {
+        'batch_size': args.batch_size,
+        'num_workers': num_workers,
+        'pin_memory': True,
+        'prefetch_factor': prefetch_factor,
+        'persistent_workers': True
+    }
+    train_sampler = make_sampler(train_dataset, train=True)
+    train_loader = DataLoader(train_dataset, shuffle=train_sampler is None, sampler=train_sampler, **common_loader_params)
+    test_loader = DataLoader(test_dataset, shuffle=False, sampler=make_sampler(test_dataset, train=False),
+                             **common_loader_params)
+    return train_loader, test_loader, train_sampler
+
+
+def predict_heads(model, test_loader, args, device, n_heads=1):
+    """
+    Runs the test loader through the model once, with the evaluation settings of the config (precision, flip,
+    no_conf, root_rel, gt_2d). Returns the normalized predictions of every output head, in order, as
+    (n_clips, T, J, 3) arrays covering the samples of test_loader only.
+    n_heads: number of empty arrays returned for an empty loader, e.g. the shard of a rank beyond the test set,
+             which still has to take part in gather_predictions
+    """
+    precision = get_precision(args)
+    no_conf = args.get('no_conf', False)
+    results = None
+    model = eval_model(model)
+    model.eval()
+    with torch.no_grad():
+        for x, _ in tqdm(test_loader):
+            x = x.to(device)
+            if no_conf:
+                x = x[..., :2]
+
+            with autocast(precision, device):
+                if args.flip:
+                    outputs = flip_inference(model, x)
+                else:
+                    outputs = to_float(model(x))
+            if not isinstance(outputs, tuple):
+                outputs = (outputs,)
+            if results is None:
+                results = [[] for _ in outputs]
+
+            for head_results, output in zip(results, outputs):
+                if args.root_rel:
+                    output[:, :, 0, :] = 0  # [N,T,17,3]
+                if args.get('gt_2d', False):
+                    output[..., :2] = x[..., :2]
+                head_results.append(output.cpu().numpy())
+    if results is None:
+        return [np.zeros((0, args.n_frames, args.num_joints, 3), dtype=np.float32) for _ in range(n_heads)]
+    return [np.concatenate(head_results) for head_results in results]
+
+
+class Trainer(object):
+    """
+    Training and evaluation engine of the H36M trainers.
+    The scripts only differ in the pieces plugged in here, so the training step, evaluation and checkpointing
+    (and everything that speeds them up) exist once.
+
+    loss_set: key of LOSS_SETS
+    heads: key of HEADS, the output-head contract of the model
+    eval_heads: suffixes of the heads that are evaluated and checkpointed, all heads by default.
+                With args.eval_average_head, multi-head models also evaluate AVERAGE_HEAD.
+    checkpoint_format: CheckpointFormat of the written checkpoints
+    print_every: if > 0, print the loss components every `print_every` training steps
+    augment_2d: apply the 2D noise and masking of the config on top of flipping (see BatchAugmenter)
+    """
+    def __init__(self, args, device, loss_set='pose', heads='single', eval_heads=None,
+                 checkpoint_format=H36M_CHECKPOINTS, print_every=0, augment_2d=False):
+        assert loss_set in LOSS_SETS, f"loss_set must be one of {list(LOSS_SETS)}, got {loss_set}"
+        assert heads in HEADS, f"heads must be one of {list(HEADS)}, got {heads}"
+        self.args = args
+        self.device = device
+        self.precision = get_precision(args)
+        self.head_suffixes = HEADS[heads]
+        self.eval_heads = self.head_suffixes if eval_heads is None else tuple(eval_heads)
+        if len(self.head_suffixes) > 1 and args.get('eval_average_head', False):
+            self.eval_heads += (AVERAGE_HEAD,)
+        assert set(self.eval_heads) <= set(self.head_suffixes + (AVERAGE_HEAD,))
+        self.loss_fn = PoseLossBundle.from_args(args, **LOSS_SETS[loss_set])
+        assert len(self.loss_fn.head_suffixes) == len(self.head_suffixes), \
+            f"Loss set {loss_set} does not match the {heads} output heads"
+        self.checkpoint_format = checkpoint_format
+        self.snapshot_top_k = args.get('checkpoint_top_k', checkpoint_format.snapshot_top_k)
+        self.checkpoint_metric = args.get('checkpoint_metric', 'mpjpe')
+        assert self.checkpoint_metric in ('mpjpe', 'p_mpjpe'), \
+            f"checkpoint_metric must be mpjpe or p_mpjpe, got {self.checkpoint_metric}"
+        self.checkpoints = CheckpointManager()
+        self.print_every = print_every
+
+        self.no_conf = args.get('no_conf', False)
+        self.augmenter = BatchAugmenter(args, device, augment_2d)
+        self.eval_index = None
+        self.ema_decay = args.get('ema_decay', 0)
+        self.accumulation_steps = args.get('accumulation_steps', 1)
+        self.ema = None
+        self.resumed_top_k = {}
+
+    def attach_ema(self, model):
+        """Starts tracking the EMA of the weights of `model` when args.ema_decay is set."""
+        if self.ema is None and self.ema_decay > 0:
+            self.ema = ModelEMA(model, self.ema_decay)
+
+    def ema_weights(self, use_ema=True):
+        """Context in which the model holds its EMA weights; a no-op without EMA."""
+        if use_ema and self.ema is not None:
+            return self.ema.swapped()
+        return contextlib.nullcontext()
+
+    def loss_names(self):
+        return self.loss_fn.component_names() + ['total']
+
+    def sync_gradients(self, model, sync):
+        """Skips the DDP gradient all-reduce of the backward passes of intermediate accumulation steps."""
+        if sync or not isinstance(model, DistributedDataParallel):
+            return contextlib.nullcontext()
+        return model.no_sync()
+
+    def train_one_epoch(self, model, train_loader, optimizer, scaler, losses):
+        """
+        With args.accumulation_steps = k, the gradients of k consecutive batches are accumulated and the optimizer
+        steps once, i.e. with an effective batch size of k * batch_size. Every batch loss is divided by the number of
+        batches of its step, so the accumulated gradient is their mean. The learning rate is not scaled.
+        """
+        args = self.args
+        model.train()
+        accumulator = LossAccumulator(losses)
+        n_batches = len(train_loader)
+        optimizer.zero_grad()
+        for step, (x, y) in enumerate(tqdm(train_loader)):
+            batch_size = x.shape[0]
+            group_start = step - step % self.accumulation_steps
+            group_size = min(self.accumulation_steps, n_batches - group_start)
+            last_of_group = step + 1 == group_start + group_size
+            x, y = x.to(self.device, non_blocking=True), y.to(self.device, non_blocking=True)
+
+            with torch.no_grad():
+                if self.no_conf:
+                    x = x[..., :2]
+                if args.root_rel:
+                    y = y - y[..., 0:1, :]
+                else:
+                    y[..., 2] = y[..., 2] - y[:, 0:1, 0:1, 2]  # Place the depth of first frame root to be 0
+                x, y = self.augmenter(x, y)
+
+            with self.sync_gradients(model, last_of_group):
+                with autocast(self.precision, self.device):
+                    pred = model(x)  # (N, T, 17, 3), or a tuple with one of them per head
+
+                loss_total, loss_terms = self.loss_fn(pred, y)
+
+                accumulator.update({**loss_terms, 'total': loss_total}, batch_size)
+
+                scaler.scale(loss_total / group_size).backward()
+
+            if last_of_group:
+                scaler.step(optimizer)
+                scaler.update()
+                optimizer.zero_grad()
+                if self.ema is not None:
+                    self.ema.update()
+
+            if self.print_every > 0 and (step + 1) % self.print_every == 0:
+                for name, value in loss_terms.items():
+                    print(f"loss_{name}:", value.item())
+                print("loss_total:", loss_total.item())
+        accumulator.flush()
+
+    def predict(self, model, test_loader, datareader=None):
+        """
+        Runs the test set through the model once.
+        datareader: denormalizes the predictions; without it they are returned normalized
+        Returns a dict mapping every head suffix to its predictions on the main process, None elsewhere.
+        Multi-head models also get the average of all heads under AVERAGE_HEAD.
+        """
+        n_heads = len(self.head_suffixes)
+        results = predict_heads(model, test_loader, self.args, self.device, n_heads)[:n_heads]
+        results = [gather_predictions(head_results) for head_results in results]
+        if not is_main_process():
+            return None
+        if datareader is not None:
+            results = [datareader.denormalize(head_results) for head_results in results]
+        predictions = dict(zip(self.head_suffixes, results))
+        if AVERAGE_HEAD in self.eval_heads:
+            predictions[AVERAGE_HEAD] = sum(predictions.values()) / len(results)
+        return predictions
+
+    def get_eval_index(self, datareader):
+        """EvalIndex of the test split, built on first use and saved next to dt_file if args.eval_index_cache is set"""
+        if self.eval_index is None:
+            args = self.args
+            dt_path = dt_file_path(args) if args.get('eval_index_cache', False) else None
+            self.eval_index = EvalIndex.cached(datareader, args.get('add_velocity', False), dt_path)
+        return self.eval_index
+
+    def evaluate(self, model, test_loader, datareader, heads=None, use_ema=True):
+        """
+        heads: suffixes of the heads to evaluate, self.eval_heads by default
+        use_ema: score the EMA weights when an EMA is tracked (args.ema_decay), swapped in without a copy
+        Returns a dict mapping every evaluated head suffix to its utils.eval_h36m.evaluate_h36m metrics, on every rank.
+        """
+        heads = self.eval_heads if heads is None else heads
+        print("[INFO] Evaluation" + (" of the EMA weights" if use_ema and self.ema is not None else ""))
+        with self.ema_weights(use_ema):
+            predictions = self.predict(model, test_loader, datareader)
+        if not is_main_process():
+            return broadcast_object(None)
+
+        index = self.get_eval_index(datareader)
+        results = {}
+        for suffix in heads:
+            metrics = evaluate_h36m(predictions[suffix], device=self.device, index=index)
+            if len(self.head_suffixes) > 1:
+                print(f"[INFO] Head {head_name(suffix)}")
+            print(metrics['action_mpjpe'])
+            print(metrics['action_p_mpjpe'])
+            print('----------')
+            print('Protocol #1 Error (MPJPE):', metrics['mpjpe'], 'mm')
+            print('Acceleration error:', metrics['acceleration_error'], 'mm/s^2')
+            print('Protocol #2 Error (P-MPJPE):', metrics['p_mpjpe'], 'mm')
+            print('----------')
+            results[suffix] = metrics
+        return broadcast_object(results)
+
+    def checkpoint_state(self, epoch, lr, optimizer, model, min_mpjpe, run_id, evaluated=False):
+        """
+        The EMA weights are stored under 'ema' in the layout of the model weights, loadable with model_key='ema'.
+        evaluated: the checkpoint was selected by its metrics (best, top-k), which are those of the EMA weights,
+                   so the EMA weights are also stored under model_key and the training weights under 'raw_model'
+        """
+        state = {
+            'epoch': epoch + 1,
+            'lr': lr,
+            'optimizer': optimizer.state_dict(),
+            self.checkpoint_format.model_key: model_state_dict(model),
+            self.checkpoint_format.metric_key: min_mpjpe,
+            'wandb_id': run_id,
+        }
+        if self.snapshot_top_k > 0:
+            state['top_k'] = self.checkpoints.top_k_state()
+        if self.ema is not None:
+            with self.ema.swapped():
+                state['ema'] = model_state_dict(model)
+            state['ema_updates'] = self.ema.num_updates
+            if evaluated:
+                state['raw_model'] = state[self.checkpoint_format.model_key]
+                state[self.checkpoint_format.model_key] = state['ema']
+        return state
+
+    def save_checkpoint(self, checkpoint_path, epoch, lr, optimizer, model, min_mpjpe, run_id, evaluated=False):
+        """Snapshots the checkpoint to CPU memory; it is written in the background, see CheckpointManager."""
+        if not is_main_process():
+            return
+        self.checkpoints.save(checkpoint_path,
+                              self.checkpoint_state(epoch, lr, optimizer, model, min_mpjpe, run_id, evaluated))
+
+    def load_checkpoint(self, checkpoint_path, model, strict=True, resume=False):
+        """
+        Loads the model weights of a checkpoint and returns the whole checkpoint.
+        resume: training continues from the checkpoint, so the model gets the training weights its optimizer state
+                belongs to ('raw_model' of best and top-k checkpoints) rather than the evaluated EMA weights
+        """
+        checkpoint = torch.load(checkpoint_path, map_location=lambda storage, loc: storage)
+        model_key = 'raw_model' if resume and 'raw_model' in checkpoint else self.checkpoint_format.model_key
+        load_model_state_dict(model, checkpoint[model_key], strict=strict)
+        self.attach_ema(model)
+        if self.ema is not None and 'ema' in checkpoint:
+            with self.ema.swapped():
+                load_model_state_dict(model, checkpoint['ema'], strict=strict)
+            self.ema.num_updates = checkpoint['ema_updates']
+        self.resumed_top_k = checkpoint.get('top_k', {})
+        return checkpoint
+
+    def fit(self, model, train_loader, test_loader, datareader, optimizer, scaler, checkpoint_dir, lr,
+            epoch_start=0, min_mpjpe=float('inf'), run_id=None, train_sampler=None, logger=None):
+        """
+        Trains from `epoch_start` to args.epochs, evaluating and checkpointing every evaluated head after each epoch.
+        min_mpjpe: best MPJPE of the first head so far, the other heads start from scratch
+        The top-k snapshots of a resumed run (see load_checkpoint) keep counting towards snapshot_top_k.
+        """
+        args = self.args
+        fmt = self.checkpoint_format
+        logger = NullLogger() if logger is None else logger
+        self.attach_ema(model)
+        self.checkpoints.restore_top_k(self.resumed_top_k, checkpoint_dir, self.snapshot_top_k)
+        min_mpjpe = {suffix: min_mpjpe if suffix == self.head_suffixes[0] else float('inf')
+                     for suffix in self.eval_heads}
+
+        def checkpoint_path(name, **fields):
+            return os.path.join(checkpoint_dir, name.format(**fields))
+
+        for epoch in range(epoch_start, args.epochs):
+            print(f"[INFO] epoch {epoch}")
+            start_time = time()
+            if train_sampler is not None:
+                train_sampler.set_epoch(epoch)
+            losses = {name: AverageMeter() for name in self.loss_names()}
+
+            self.train_one_epoch(model, train_loader, optimizer, scaler, losses)
+
+            log = {'lr': lr}
+            for name, meter in losses.items():
+                log[TRAIN_LOG_KEYS.get(name, f'train/loss_{name}')] = meter.avg
+
+            if fmt.decayed_lr:  # Checkpoints store the lr (and optimizer state) of the next epoch
+                lr = decay_lr_exponentially(lr, args.lr_decay, optimizer)
+            if args.get('no_eval', False):
+                self.save_checkpoint(checkpoint_path(fmt.latest, head=''), epoch, lr, optimizer, model,
+                                     min_mpjpe.get('', float('inf')), run_id)
+            else:
+                results = self.evaluate(model, test_loader, datareader)
+                for suffix, metrics in results.items():
+                    mpjpe, p_mpjpe = metrics['mpjpe'], metrics['p_mpjpe']
+                    if mpjpe < min_mpjpe[suffix]:
+                        min_mpjpe[suffix] = mpjpe
+                        self.save_checkpoint(checkpoint_path(fmt.best, head=suffix),
+                                             epoch, lr, optimizer, model, min_mpjpe[suffix], run_id, evaluated=True)
+                    if self.snapshot_top_k > 0 and is_main_process():
+                        self.checkpoints.save_top_k(
+                            suffix, self.snapshot_top_k,
+                            checkpoint_path(fmt.snapshot, head=suffix, epoch=epoch, mpjpe=mpjpe, p_mpjpe=p_mpjpe),
+                            self.checkpoint_state(epoch, lr, optimizer, model, min_mpjpe[suffix], run_id,
+                                                  evaluated=True),
+                            score=metrics[self.checkpoint_metric])
+                    self.save_checkpoint(checkpoint_path(fmt.latest, head=suffix),
+                                         epoch, lr, optimizer, model, min_mpjpe[suffix], run_id)
+                    log.update(eval_log(metrics, min_mpjpe[suffix], suffix))
+
+            elapsed = (time() - start_time) / 60
+            print(f"[INFO] epoch {epoch} took {elapsed:.2f} min, lr {lr:f}, 3d_train {losses['3d_pose'].avg:f}")
+            logger.log(log, step=epoch + 1)
+
+            if not fmt.decayed_lr:
+                lr = decay_lr_exponentially(lr, args.lr_decay, optimizer)
+
+        self.checkpoints.wait()
+        files = [checkpoint_path(fmt.latest, head=''), checkpoint_path(fmt.best, head='')]
+        logger.finish([file for file in files if os.path.exists(file)])
+
+
+def run(args, opts, loss_set='pose', heads='single', eval_heads=None, checkpoint_format=H36M_CHECKPOINTS,
+        print_every=0):
+    """
+    Entry point of train.py, train_2.py, train_ende.py and train_ende2.py, which share their command line options
+    and only differ in the arguments passed to the Trainer.
+    """
+    device = init_distributed_mode()
+    print_args(args)
+    create_directory_if_not_exists(opts.new_checkpoint)
+
+    datareader = make_datareader(args)  # Used for H36m evaluation
+    train_dataset, test_dataset = make_datasets(args, datareader)
+    train_loader, test_loader, train_sampler = make_loaders(args, train_dataset, test_dataset,
+                                                            num_workers=opts.num_cpus - 1,
+                                                            prefetch_factor=(opts.num_cpus - 1) // 3)
+
+    model = wrap_model(grad_checkpoint_from_args(load_model(args), args), device)
+    compile_model(model, args, device, inference=False)  # The wrapper, in place: checkpoints keep their layout
+
+    n_params = count_param_numbers(model)
+    print(f"[INFO] Number of parameters: {n_params:,}")
+
+    trainer = Trainer(args, device, loss_set=loss_set, heads=heads, eval_heads=eval_heads,
+                      checkpoint_format=checkpoint_format, print_every=print_every)
+
+    lr = args.learning_rate
+    optimizer = optim.AdamW(filter(lambda p: p.requires_grad, model.parameters()),
+                            lr=lr,
+                            weight_decay=args.weight_decay)
+    scaler = make_grad_scaler(trainer.precision, device)
+    epoch_start = 0
+    min_mpjpe = float('inf')  # Used for storing the best model
+    run_id = opts.wandb_run_id if opts.wandb_run_id is not None else new_run_id()
+
+    if opts.checkpoint:
+        checkpoint_path = os.path.join(opts.checkpoint, opts.checkpoint_file if opts.checkpoint_file else "latest_epoch.pth.tr")
+        if os.path.exists(checkpoint_path):
+            checkpoint = trainer.load_checkpoint(checkpoint_path, model, resume=opts.resume)
+            print('loading checkpoint file: ', checkpoint_path)
+
+            if opts.resume:
+                lr = checkpoint['lr']
+                epoch_start = checkpoint['epoch']
+                optimizer.load_state_dict(checkpoint['optimizer'])
+                min_mpjpe = checkpoint[checkpoint_format.metric_key]
+                if 'wandb_id' in checkpoint and opts.wandb_run_id is None:
+                    run_id = checkpoint['wandb_id']
+        else:
+            print("[WARN] Checkpoint path is empty. Starting from the beginning")
+            opts.resume = False
+
+    if opts.eval_only:
+        trainer.evaluate(model, test_loader, datareader)
+        return
+
+    if not opts.resume:
+        print(f"Run ID: {run_id}")
+    logger = make_logger('wandb' if opts.use_wandb else 'none', args=args, opts=opts, run_id=run_id,
+                         resume=opts.resume)
+    trainer.fit(model, train_loader, test_loader, datareader, optimizer, scaler, opts.new_checkpoint, lr,
+                epoch_start=epoch_start, min_mpjpe=min_mpjpe, run_id=run_id, train_sampler=train_sampler,
+                logger=logger)